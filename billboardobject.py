@@ -4,14 +4,59 @@ from panda3d.core import TextureStage, CardMaker, Vec3, TransparencyAttrib, Text
 from direct.showbase.DirectObject import DirectObject
 from panda3d.bullet import BulletRigidBodyNode, BulletCapsuleShape
 
+from collisionevents import ENEMY, tag, untag
 from crystalobject import CrystalObject
-from pathfinder import Pathfinder
+from enemysystem import Packed, getEnemySystem
+from navmapregistry import registry
 from resourcepath import resource_path
 
+# (texture, scale) -> (card, shape) shared by every enemy that looks the same, see sharedCard
+_cards = {}
+
+
+def sharedCard(texture, scale):
+    """
+    The card (geometry and render state, already a billboard) and capsule of enemies with texture at scale. They're
+    built once, every enemy instances the same card and adds the same shape to its body, so there is one node and
+    one state for the shader generator and the renderer per type of enemy.
+
+    Return
+    a 2-tuple of the card NodePath (not in the scene graph, instance it) and the BulletCapsuleShape
+    """
+    key = (texture, scale)
+    if key not in _cards:
+        aspect_ratio = texture.getXSize() / texture.getYSize()
+
+        # Create Card, set texture, and make it a billboard
+        card = CardMaker('Billboard')
+        card.setFrame(-aspect_ratio * scale, aspect_ratio * scale, -scale, scale)
+        cardNP = NodePath(card.generate())
+        cardNP.setTexture(texture)
+        cardNP.setTransparency(TransparencyAttrib.MAlpha)
+        cardNP.setBillboardAxis()
+        cardNP.setShaderAuto()
+
+        shape = BulletCapsuleShape(scale / 2, scale * aspect_ratio, 2)
+        _cards[key] = (cardNP, shape)
+    return _cards[key]
 
-class BillBoardObject(DirectObject):
 
-    def __init__(self, texture, position=Vec3(0, 0, 1), scale=1, drop=None, pathfinder=None):
+class BillBoardObject(DirectObject):
+    # kept in the enemy system's arrays while the enemy is alive, see EnemySystem
+    slot = None
+    target = Packed()
+    maxSpeed = Packed()
+    health = Packed()
+    lifetime = Packed()
+    pathLifetime = Packed()
+    stuckSpeed = Packed()
+
+    def __init__(self, texture, position=Vec3(0, 0, 1), scale=1, drop=None, pathfinder=None, pathService=None,
+                 enemySystem=None, pool=None, renderer=None):
+        """
+        Build an enemy and spawn it at position. With position None it's left parked out of the world until spawn()
+        is called, pool gets it back instead of it being thrown away when it dies (see EnemyPool).
+        """
         DirectObject.__init__(self)
         self.position = position
         self.scale = scale
@@ -21,31 +66,51 @@ class BillBoardObject(DirectObject):
         self.tex_height = self.texture.getYSize()
         self.aspect_ratio = self.tex_width / self.tex_height
 
-        # Create Card, set texture, and make it a billboard
-        self.card = CardMaker('Billboard')
-        self.card.setFrame(-self.aspect_ratio * self.scale, self.aspect_ratio * self.scale, -self.scale, self.scale)
-        self.BillboardNP = base.render.attachNewNode(self.card.generate())
-        self.BillboardNP.setTexture(self.texture)
-        self.BillboardNP.setTransparency(TransparencyAttrib.MAlpha)
-        self.BillboardNP.setBillboardAxis()
-        self.BillboardNP.setShaderAuto()
+        shape = sharedCard(self.texture, self.scale)[1]
 
         # Add Physics
         self.card_physics_node = BulletRigidBodyNode('Billboard')
         self.card_physics_node.setMass(0.01)
-        shape = BulletCapsuleShape(self.scale / 2, self.scale * self.aspect_ratio, 2)
         self.card_physics_node.addShape(shape)
-        base.world.attachRigidBody(self.card_physics_node)
-        self.card_physics_np = base.render.attachNewNode(self.card_physics_node)
-        self.card_physics_np.setPos(position)
-        self.BillboardNP.reparentTo(self.card_physics_np)
+        tag(self.card_physics_node, ENEMY, self)
+        self.card_physics_np = NodePath(self.card_physics_node)
+        self.BillboardNP = None
 
         # Make item upright
         self.card_physics_node.setAngularFactor(Vec3(0, 0, 1))
         self.card_physics_node.setLinearSleepThreshold(0)
 
-        self.health = 1
         self.maxSpeed = 18
+
+        self.playerNode = base.render.findAllMatches("**/*Player")[0]
+
+        self.nav_offset = Vec3(50, 50, 3)
+
+        # without a service, searches are time-sliced: at most searchBudget jump points are expanded a frame
+        self.searchBudget = 50
+
+        # below this speed an enemy counts as stuck and blocks its cell for everyone else's searches
+        self.stuckSpeed = 1.0
+
+        self.pool = pool
+        self.active = False
+        if position is not None:
+            self.spawn(position, drop, pathfinder, pathService, enemySystem, renderer)
+
+    def spawn(self, position, drop=None, pathfinder=None, pathService=None, enemySystem=None, renderer=None):
+        """
+        Put the enemy into the world at position with full health, chasing the player. It's drawn by renderer
+        (a BillboardRenderer in the same enemy system) if given, as a card of its own otherwise.
+        """
+        self.position = position
+        self.card_physics_np.reparentTo(base.render)
+        base.world.attachRigidBody(self.card_physics_node)
+        self.card_physics_np.setPosHpr(position, Vec3(0, 0, 0))
+        self.card_physics_node.setLinearVelocity(Vec3(0, 0, 0))
+        self.card_physics_node.setAngularVelocity(Vec3(0, 0, 0))
+        self.card_physics_node.clearForces()
+
+        self.health = 1
         self.lifetime = 1
 
         self.dropPath = resource_path('Assets/assets/Bullet/Bullet.bam')
@@ -60,102 +125,128 @@ class BillBoardObject(DirectObject):
             self.dropPath = resource_path('Assets/assets/BlueCrystal/Blue.bam')
             self.dropName = 'blue_crystal'
 
-        self.playerNode = base.render.findAllMatches("**/*Player")[0]
-
         if pathfinder is None:
-            self.pathfinder = Pathfinder()
-            self.pathfinder.loadMap(resource_path('NavMeshes/defaultnavmesh.json'))
+            self.pathfinder = registry.getPathfinder(resource_path('NavMeshes/defaultnavmesh.nav'))
         else:
             self.pathfinder = pathfinder
 
-        self.nav_offset = Vec3(50, 50, 3)
-        self.path = self.pathfinder.getPath(start=self.card_physics_np.getPos() + self.nav_offset, end=self.playerNode.getPos() + self.nav_offset)
-        self.current_node = 0
-        self.target = self.playerNode.getPos()
+        # searches go through the path service if there is one, so they never stall the frame
+        self.pathService = pathService
 
-        self.path_lifetime = 5
+        # only route through cells the capsule fits in, so enemies don't end up pushing against walls
+        self.clearance = self.pathfinder.clearanceFor(self.scale / 2)
 
-        self.add_task(self.collision_check, "collision_check")
-        self.add_task(self.move_toward, 'pathfind')
-        self.add_task(self.track_lifetime, "track_lifetime")
-
-    def collision_check(self, task):
-        if self.health < 0:
-            pos = self.card_physics_np.getPos()
-            CrystalObject(pos, self.dropPath, name=self.dropName)
+        self.path = None
+        self.current_node = 0
+        self.target = self.playerNode.getPos()
 
-            self.removeEnemy()
+        self.pathLifetime = 5
 
-            return task.done
+        self.search = None
 
+        if self.pathService is None:
+            self.start_search()
         else:
-            check = base.world.contactTest(self.card_physics_node)
-            for contact in check.getContacts():
-                if contact.getNode1().getName().find('Bullet') != -1:
-                    self.health -= 0.25
-
-        return task.cont
-
-    def track_lifetime(self, task):
-        if self.lifetime < 0:
-            self.health = -0.1
-            return task.done
-
-        if self.card_physics_node.getLinearVelocity().length() < 0.1:
-            self.lifetime -= 0.01
-
-        return task.cont
-
-    def move_toward(self, task):
-        if self.health < 0 or self.card_physics_node is None:
-            if self.health < 0:
-                pos = self.card_physics_np.getPos()
-                CrystalObject(pos, self.dropPath, name=self.dropName)
-
-            self.removeEnemy()
-            return task.done
-
-        direction = self.target - self.card_physics_np.getPos()
-        direction.z = 0
-        idealVelocity = direction.normalized() * self.maxSpeed
-        accel = idealVelocity - self.card_physics_node.getLinearVelocity()
-        accel.z = 0
-
-        self.card_physics_node.applyCentralForce(accel * 0.2)
-
-        self.path_lifetime -= 0.1
-
-        if self.path is not None and (self.current_node + 1) < len(self.path) and direction.length() < 1.5:
-            self.current_node += 1
-            self.target = self.path[self.current_node]
-            self.target = Vec3(self.target[0], self.target[1], 3) - self.nav_offset
-
-        if self.path is None or self.path_lifetime < 0:
-            result = base.world.rayTestClosest(self.card_physics_np.getPos(), self.playerNode.getPos())
-            if (result.hasHit() and result.getNode().getName() == 'Player') or not result.hasHit():
-                self.target = self.playerNode.getPos()
-            else:
-                try:
-                    self.path = self.pathfinder.getPath(start=self.card_physics_np.getPos() + self.nav_offset,
-                                                        end=self.playerNode.getPos() + self.nav_offset)
-                except:
-                    self.path = None
-
-                if self.path is not None:
-                    self.current_node = 0
-                    self.target = self.path[self.current_node]
-                    self.target = Vec3(self.target[0], self.target[1], 3) - self.nav_offset
-
-                    self.path_lifetime = 5
-                else:
-                    self.target = self.playerNode.getPos()
-
-        return task.cont
+            self.request_path()
+
+        # steering, collisions and lifetimes are updated for every enemy at once
+        self.enemySystem = enemySystem if enemySystem is not None else getEnemySystem()
+        self.enemySystem.add(self)
+
+        self.renderer = renderer
+        if self.renderer is not None:
+            if self.BillboardNP is not None:
+                self.BillboardNP.removeNode()
+                self.BillboardNP = None
+            self.renderer.add(self)
+        elif self.BillboardNP is None:
+            self.BillboardNP = sharedCard(self.texture, self.scale)[0].instanceTo(self.card_physics_np)
+
+        self.active = True
+
+    def die(self):
+        pos = self.card_physics_np.getPos()
+        CrystalObject(pos, self.dropPath, name=self.dropName)
+
+        self.removeEnemy()
+
+    def next_waypoint(self):
+        """ Head for the next waypoint of the path, called by the enemy system once the current one is reached """
+        self.current_node += 1
+        waypoint = self.path[self.current_node]
+        self.target = Vec3(waypoint[0], waypoint[1], 3) - self.nav_offset
+
+    def update_path(self):
+        """ Called by the enemy system while there is no path or it's out of date """
+        # check visibility on the nav grid rather than raycasting through Bullet
+        if self.pathfinder.hasLineOfSight(self.card_physics_np.getPos() + self.nav_offset,
+                                          self.playerNode.getPos() + self.nav_offset, self.clearance):
+            self.target = self.playerNode.getPos()
+            if self.search is not None:
+                self.search.cancel()
+                self.search = None
+        elif self.pathService is not None:
+            # keep chasing the current target until the service answers
+            if not self.pathService.isPending(self):
+                self.request_path()
+        else:
+            # keep chasing the current target until the search finishes
+            if self.search is None:
+                self.start_search()
+            if self.search.step(self.searchBudget):
+                path = self.search.path
+                self.search = None
+                self.follow_path(path)
+
+    def start_search(self):
+        self.search = self.pathfinder.startSearch(self.card_physics_np.getPos() + self.nav_offset,
+                                                  self.playerNode.getPos() + self.nav_offset, self.clearance)
+
+    def request_path(self):
+        self.pathService.request(self, self.card_physics_np.getPos() + self.nav_offset,
+                                 self.playerNode.getPos() + self.nav_offset, self.follow_path, self.clearance)
+
+    def follow_path(self, path):
+        self.path = self.pathfinder.smoothPath(path, self.clearance)
+
+        if self.path is not None:
+            self.current_node = 0
+            waypoint = self.path[self.current_node]
+            self.target = Vec3(waypoint[0], waypoint[1], 3) - self.nav_offset
+
+            self.pathLifetime = 5
+        else:
+            self.target = self.playerNode.getPos()
 
     def removeEnemy(self):
+        if not self.active:
+            return
+        self.active = False
+
         self.removeAllTasks()
         self.ignoreAll()
-
-        if self.card_physics_node is not None:
+        self.enemySystem.remove(self)
+        if self.renderer is not None:
+            self.renderer.remove(self)
+
+        if self.pathService is not None:
+            self.pathService.cancel(self)
+        if self.search is not None:
+            self.search.cancel()
+            self.search = None
+        if self.pathfinder.overlay is not None:
+            self.pathfinder.overlay.clear(self)
+
+        base.world.remove(self.card_physics_node)
+        if self.pool is not None:
+            # parked out of the world until the pool spawns it again
+            self.card_physics_np.detachNode()
+            self.pool.release(self)
+        else:
             self.card_physics_node.removeAllChildren()
-            base.world.remove(self.card_physics_node)
+            untag(self.card_physics_node)
+
+    def destroy(self):
+        """ Throw away a parked enemy for good """
+        untag(self.card_physics_node)
+        self.card_physics_np.removeNode()
@@ -0,0 +1,248 @@
+import numpy as np
+from direct.showbase.DirectObject import DirectObject
+from panda3d.core import CardMaker, GeomEnums, OmniBoundingVolume, Shader, Texture, TransparencyAttrib
+
+from enemysystem import getEnemySystem
+
+# texels per instance in the buffer texture: x, y, z, scale then the tint
+TEXELS = 2
+
+# above the shader CustomPipeline gives its shadow cameras, so the instances are placed the same in the shadow pass
+SHADER_PRIORITY = 10
+
+# the most lights a card is lit by, CustomPipeline's default
+MAX_LIGHTS = 8
+
+VERTEX = """
+#version 140
+
+uniform mat4 p3d_ProjectionMatrix;
+uniform mat4 p3d_ViewMatrix;
+uniform mat4 p3d_ViewMatrixInverse;
+uniform samplerBuffer instances;
+
+in vec4 p3d_Vertex;
+in vec2 p3d_MultiTexCoord0;
+
+out vec2 texcoord;
+out vec4 tint;
+out vec3 viewPosition;
+out vec3 viewNormal;
+
+void main() {
+    vec4 placement = texelFetch(instances, gl_InstanceID * 2);
+    tint = texelFetch(instances, gl_InstanceID * 2 + 1);
+
+    // turn the card about the vertical axis to face the camera, what setBillboardAxis did during cull
+    vec2 eye = p3d_ViewMatrixInverse[3].xy - placement.xy;
+    vec2 facing = dot(eye, eye) > 0.000001 ? normalize(eye) : vec2(0.0, -1.0);
+    vec3 right = vec3(-facing.y, facing.x, 0.0);
+    vec3 world = placement.xyz + (right * p3d_Vertex.x + vec3(0.0, 0.0, p3d_Vertex.z)) * placement.w;
+
+    // lit in view space like the auto shader, the card's normal faces the camera with it
+    vec4 view = p3d_ViewMatrix * vec4(world, 1.0);
+    viewPosition = view.xyz;
+    viewNormal = (p3d_ViewMatrix * vec4(facing, 0.0, 0.0)).xyz;
+
+    gl_Position = p3d_ProjectionMatrix * view;
+    texcoord = p3d_MultiTexCoord0;
+}
+"""
+
+# lit the way the auto shader lit the single cards: the ambient light plus every light's diffuse term, with
+# its spotlight cone, attenuation and shadow map
+FRAGMENT = """
+#version 140
+
+#define MAX_LIGHTS %d
+
+uniform sampler2D p3d_Texture0;
+uniform vec4 p3d_ColorScale;
+
+uniform struct {
+    vec4 ambient;
+} p3d_LightModel;
+
+uniform struct {
+    vec4 color;
+    vec4 position;
+    vec3 spotDirection;
+    float spotExponent;
+    float spotCosCutoff;
+    vec3 attenuation;
+    sampler2DShadow shadowMap;
+    mat4 shadowViewMatrix;
+} p3d_LightSource[MAX_LIGHTS];
+
+in vec2 texcoord;
+in vec4 tint;
+in vec3 viewPosition;
+in vec3 viewNormal;
+
+out vec4 color;
+
+void main() {
+    color = texture(p3d_Texture0, texcoord) * tint * p3d_ColorScale;
+    // instances aren't sorted against each other, so leave the see-through parts out of the depth buffer
+    if (color.a < 0.5) {
+        discard;
+    }
+
+    vec3 normal = normalize(viewNormal);
+    vec3 light = p3d_LightModel.ambient.rgb;
+    for (int i = 0; i < MAX_LIGHTS; ++i) {
+        // position is a direction toward the light (w 0) for directional lights
+        vec4 position = p3d_LightSource[i].position;
+        vec3 toLight = position.xyz - viewPosition * position.w;
+        float distance = length(toLight);
+        vec3 direction = toLight / max(distance, 0.0001);
+
+        float lit = max(dot(normal, direction), 0.0);
+        if (p3d_LightSource[i].spotCosCutoff > -1.0) {
+            float cosAngle = dot(normalize(p3d_LightSource[i].spotDirection), -direction);
+            lit *= cosAngle > p3d_LightSource[i].spotCosCutoff ? pow(cosAngle, p3d_LightSource[i].spotExponent) : 0.0;
+        }
+        vec3 attenuation = p3d_LightSource[i].attenuation;
+        lit /= attenuation.x + (attenuation.y + attenuation.z * distance) * distance * position.w;
+        lit *= textureProj(p3d_LightSource[i].shadowMap, p3d_LightSource[i].shadowViewMatrix * vec4(viewPosition, 1.0));
+        light += p3d_LightSource[i].color.rgb * lit;
+    }
+    color.rgb *= light;
+}
+""" % MAX_LIGHTS
+
+
+class _Batch:
+    """ The enemies with one texture, drawn as instances of one card """
+
+    def __init__(self, texture, shader, capacity):
+        aspect_ratio = texture.getXSize() / texture.getYSize()
+
+        # a unit card, every instance is scaled by its own scale
+        card = CardMaker('BillboardInstances')
+        card.setFrame(-aspect_ratio, aspect_ratio, -1, 1)
+        self.np = base.render.attachNewNode(card.generate())
+        self.np.setTexture(texture)
+        self.np.setTransparency(TransparencyAttrib.MAlpha)
+        self.np.setShader(shader, SHADER_PRIORITY)
+
+        # the instances are all over the map, the card's own bounds would get them culled
+        self.np.node().setBounds(OmniBoundingVolume())
+        self.np.node().setFinal(True)
+
+        self.enemies = []
+        self.index = {}  # enemy -> position in enemies
+        self.capacity = 0
+        self._allocate(capacity)
+
+        # an instance count of 0 still draws the card once, so an empty batch is hidden instead
+        self.np.hide()
+
+    def _allocate(self, capacity):
+        """ Grow the buffer texture and tints to capacity instances """
+        tint = np.ones((capacity, 4), dtype=np.float32)
+        if self.capacity:
+            tint[:self.capacity] = self.tint
+        self.tint = tint
+        self.capacity = capacity
+
+        self.buffer = Texture('billboard_instances')
+        self.buffer.setupBufferTexture(capacity * TEXELS, Texture.T_float, Texture.F_rgba32, GeomEnums.UH_dynamic)
+        self.np.setShaderInput('instances', self.buffer)
+
+    def add(self, enemy):
+        if len(self.enemies) == self.capacity:
+            self._allocate(self.capacity * 2)
+        self.index[enemy] = len(self.enemies)
+        self.tint[len(self.enemies)] = 1
+        self.enemies.append(enemy)
+
+    def remove(self, enemy):
+        i = self.index.pop(enemy)
+        last = self.enemies.pop()
+        if last is not enemy:
+            self.enemies[i] = last
+            self.index[last] = i
+            self.tint[i] = self.tint[len(self.enemies)]
+
+    def update(self, position):
+        """ Write the placement of every enemy into the buffer, position is the enemy system's array """
+        count = len(self.enemies)
+        if count:
+            slots = np.fromiter((enemy.slot for enemy in self.enemies), dtype=int, count=count)
+            scale = np.fromiter((enemy.scale for enemy in self.enemies), dtype=np.float32, count=count)
+            data = np.frombuffer(self.buffer.modifyRamImage(), dtype=np.float32).reshape(-1, TEXELS, 4)
+            data[:count, 0, :3] = position[slots]
+            data[:count, 0, 3] = scale
+            data[:count, 1] = self.tint[:count]
+            self.np.setInstanceCount(count)
+            self.np.show()
+        else:
+            self.np.hide()
+
+
+class BillboardRenderer(DirectObject):
+    """
+    Draws the billboard enemies with hardware instancing: one card per enemy texture and one draw call for all the
+    enemies using it, however many there are. Every frame the placement of each enemy (taken from the EnemySystem's
+    packed positions) and its tint are written into a buffer texture, the vertex shader places each instance and
+    turns it to face the camera.
+
+    The cards carry their own shader, lit by the scene's lights like the auto shader lit the single cards, so they
+    work under CustomPipeline (they're drawn into its HDR scene buffer and tonemapped with everything else) and
+    cast shadows in its shadow pass.
+    """
+
+    def __init__(self, enemySystem=None, capacity=64):
+        DirectObject.__init__(self)
+
+        self.enemySystem = enemySystem if enemySystem is not None else getEnemySystem()
+        self.capacity = capacity
+        self.shader = Shader.make(Shader.SL_GLSL, vertex=VERTEX, fragment=FRAGMENT)
+
+        self.batches = {}  # texture -> _Batch
+        self.batchOf = {}  # enemy -> its _Batch
+
+        # after the enemy system has read the bodies, before the frame is culled
+        self.add_task(self.update, 'billboard_renderer', sort=45)
+
+    @staticmethod
+    def isSupported(gsg=None):
+        """ Can the window draw instanced billboards, needs instancing and buffer textures (OpenGL 3.1) """
+        gsg = gsg if gsg is not None else base.win.getGsg()
+        return gsg.getSupportsGeometryInstancing() and gsg.getSupportsBufferTexture()
+
+    def add(self, enemy):
+        """ Start drawing enemy, it has to be in the renderer's enemy system """
+        batch = self.batches.get(enemy.texture)
+        if batch is None:
+            batch = self.batches[enemy.texture] = _Batch(enemy.texture, self.shader, self.capacity)
+        batch.add(enemy)
+        self.batchOf[enemy] = batch
+
+    def remove(self, enemy):
+        batch = self.batchOf.pop(enemy, None)
+        if batch is not None:
+            batch.remove(enemy)
+
+    def setTint(self, enemy, color):
+        """ Multiply enemy's texture by color (r, g, b, a) """
+        batch = self.batchOf[enemy]
+        batch.tint[batch.index[enemy]] = color
+
+    def update(self, task):
+        for batch in self.batches.values():
+            batch.update(self.enemySystem.position)
+        return task.cont
+
+    @property
+    def drawCalls(self):
+        return sum(1 for batch in self.batches.values() if batch.enemies)
+
+    def destroy(self):
+        self.removeAllTasks()
+        self.ignoreAll()
+        for batch in self.batches.values():
+            batch.np.removeNode()
+        self.batches.clear()
+        self.batchOf.clear()
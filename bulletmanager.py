@@ -7,6 +7,7 @@ from direct.task import Task
 from panda3d.bullet import BulletConvexHullShape, BulletRigidBodyNode
 from panda3d.core import Vec3
 
+from collisionevents import BULLET, tag
 from resourcepath import resource_path
 
 
@@ -71,6 +72,8 @@ class BulletManager(DirectObject):
 
         self.bulletModels = [self.redBullet, self.blueBullet, self.greenBullet]
         self.bulletNodes = [self.redBulletNP, self.blueBulletNP, self.greenBulletNP]
+        for node in self.bulletNodes:
+            tag(node, BULLET)  # make_copy keeps it, every bullet spawned is tagged
         self.bullets = []
 
         self.add_task(self.track_lifetime, 'track_bullets')
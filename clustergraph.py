@@ -0,0 +1,297 @@
+import heapq
+import itertools
+import json
+import zlib
+
+from direct.stdpy.file import exists, open
+
+from pathfinder import OBSTACLE, FLOW_DIRECTIONS, _compressPath
+
+# entrances at least this wide get a transition at both ends instead of one in the middle
+WIDE_ENTRANCE = 6
+
+
+class ClusterGraph:
+    """
+    The abstract graph for hierarchical pathfinding (HPA*) over a NavMap's grid.
+
+    The grid is split into clusterSize x clusterSize clusters. Every free run along a cluster border
+    becomes one or two transitions, each a pair of entrance nodes facing each other across the border.
+    Entrances of the same cluster are linked with their exact distance inside that cluster, so a query
+    only searches the small abstract graph and then refines each hop with a search bounded to one cluster.
+    """
+
+    def __init__(self, navmap, clusterSize=10):
+        self.navmap = navmap
+        self.clusterSize = clusterSize
+
+        self.nodes = []  # flat index of each entrance node
+        self.nodeIds = {}  # flat index -> node id
+        self.edges = []  # per node, a list of (neighbour id, cost)
+        self.clusterNodes = {}  # (cluster x, cluster y) -> node ids inside it
+
+    def checksum(self):
+        """ Identifies the grid and cluster size this graph was built for """
+        return zlib.crc32(self.navmap.grid.tobytes()) ^ self.clusterSize
+
+    def _cluster(self, index):
+        x, y = divmod(index, self.navmap.stride)
+        return (x - 1) // self.clusterSize, (y - 1) // self.clusterSize
+
+    def _addNode(self, index):
+        if index not in self.nodeIds:
+            self.nodeIds[index] = len(self.nodes)
+            self.nodes.append(index)
+            self.edges.append([])
+            self.clusterNodes.setdefault(self._cluster(index), []).append(self.nodeIds[index])
+        return self.nodeIds[index]
+
+    def _addEdge(self, a, b, cost):
+        self.edges[a].append((b, cost))
+        self.edges[b].append((a, cost))
+
+    def _search(self, source, cluster, other=None):
+        """
+        Breadth first search from source that never leaves cluster, or the box of clusters from cluster to other.
+
+        Return
+        a dict of every reached flat index to its predecessor (source maps to itself) and a dict of their distances
+        """
+        pf = self.navmap
+        grid = pf.grid
+        stride = pf.stride
+        size = self.clusterSize
+        other = cluster if other is None else other
+        x0 = min(cluster[0], other[0]) * size
+        y0 = min(cluster[1], other[1]) * size
+        x1 = min((max(cluster[0], other[0]) + 1) * size, pf.width)
+        y1 = min((max(cluster[1], other[1]) + 1) * size, pf.height)
+
+        parents = {source: source}
+        distance = {source: 0}
+        frontier = [source]
+        while frontier:
+            next_frontier = []
+            for cur in frontier:
+                cx, cy = divmod(cur, stride)
+                for dx, dy in FLOW_DIRECTIONS:
+                    if x0 <= cx - 1 + dx < x1 and y0 <= cy - 1 + dy < y1:
+                        n = cur + dx * stride + dy
+                        if n not in parents and grid[n] != OBSTACLE:
+                            parents[n] = cur
+                            distance[n] = distance[cur] + 1
+                            next_frontier.append(n)
+            frontier = next_frontier
+        return parents, distance
+
+    def _addEntrances(self, run, side):
+        """ Turn a free run of border cells into transitions, side is the index offset across the border """
+        if len(run) < WIDE_ENTRANCE:
+            transitions = [run[len(run) // 2]]
+        else:
+            transitions = [run[0], run[-1]]
+        for index in transitions:
+            self._addEdge(self._addNode(index), self._addNode(index + side), 1)
+
+    def build(self, previous=None, clusters=()):
+        """
+        Find every transition and link the entrances of each cluster. With previous, the graph of the same map
+        before some of its cells changed, only the clusters in clusters (the ones with changed cells) and the ones
+        whose entrances moved are searched again, the rest take their distances from previous.
+        """
+        pf = self.navmap
+        grid = pf.grid
+        stride = pf.stride
+        size = self.clusterSize
+
+        self.nodes = []
+        self.nodeIds = {}
+        self.edges = []
+        self.clusterNodes = {}
+
+        # transitions across vertical borders (between x and x + 1) and horizontal ones (between y and y + 1)
+        for border, length, along, across in ((pf.width, pf.height, 1, stride), (pf.height, pf.width, stride, 1)):
+            for b in range(size - 1, border - 1, size):
+                for start in range(0, length, size):
+                    run = []
+                    for a in range(start, min(start + size, length)):
+                        index = (b + 1) * across + (a + 1) * along
+                        if grid[index] != OBSTACLE and grid[index + across] != OBSTACLE:
+                            run.append(index)
+                        elif run:
+                            self._addEntrances(run, across)
+                            run = []
+                    if run:
+                        self._addEntrances(run, across)
+
+                # diagonal squeezes where the only way across the border is a corner to corner step
+                for a in range(length - 1):
+                    index = (b + 1) * across + (a + 1) * along
+                    for near, far in ((index, index + across + along), (index + along, index + across)):
+                        if grid[near] != OBSTACLE and grid[far] != OBSTACLE and \
+                                grid[near + across] == OBSTACLE and grid[far - across] == OBSTACLE:
+                            self._addEdge(self._addNode(near), self._addNode(far), 1)
+
+        # exact distances between the entrances of each cluster
+        for cluster, ids in self.clusterNodes.items():
+            if previous is not None and cluster not in clusters and self._copyLinks(previous, cluster):
+                continue
+            for i, a in enumerate(ids):
+                _, distance = self._search(self.nodes[a], cluster)
+                for b in ids[i + 1:]:
+                    if self.nodes[b] in distance:
+                        self._addEdge(a, b, distance[self.nodes[b]])
+
+    def _copyLinks(self, previous, cluster):
+        """ Copy the links inside cluster from previous if it had the same entrances there """
+        old = previous.clusterNodes.get(cluster, [])
+        if sorted(previous.nodes[a] for a in old) != sorted(self.nodes[a] for a in self.clusterNodes[cluster]):
+            return False
+        for a in old:
+            for b, cost in previous.edges[a]:
+                if a < b and b in old:
+                    self._addEdge(self.nodeIds[previous.nodes[a]], self.nodeIds[previous.nodes[b]], cost)
+        return True
+
+    def patched(self, navmap, region):
+        """
+        The graph for navmap, a copy of this graph's map with the cells in region (x0, x1, y0, y1, the ends
+        excluded) changed. Only the clusters around region are searched again.
+        """
+        x0, x1, y0, y1 = region
+        size = self.clusterSize
+        graph = ClusterGraph(navmap, size)
+        graph.build(self, {(cx, cy) for cx in range(x0 // size, (x1 - 1) // size + 1)
+                           for cy in range(y0 // size, (y1 - 1) // size + 1)})
+        return graph
+
+    def save(self, name):
+        data = {
+            'checksum': self.checksum(),
+            'clusterSize': self.clusterSize,
+            'nodes': self.nodes,
+            'edges': [[a, b, cost] for a, neighbours in enumerate(self.edges) for b, cost in neighbours if a < b],
+        }
+        with open(name, 'w') as outfile:
+            json.dump(data, outfile)
+
+    def load(self, name):
+        """
+        Load a graph saved by save(), only if it was built for the current grid.
+
+        Return
+        True if the graph was loaded
+        """
+        if not exists(name):
+            return False
+        try:
+            with open(name) as f:
+                data = json.load(f)
+        except:
+            return False
+        if data.get('clusterSize') != self.clusterSize or data.get('checksum') != self.checksum():
+            return False
+
+        self.nodes = []
+        self.nodeIds = {}
+        self.edges = []
+        self.clusterNodes = {}
+        for index in data['nodes']:
+            self._addNode(index)
+        for a, b, cost in data['edges']:
+            self._addEdge(a, b, cost)
+        return True
+
+    def getPath(self, start, end):
+        """
+        Find a path between the free cells with flat indices start and end.
+
+        Return
+        a list of jump points as 2-tuples (coordinates) starting from the start node and finishing at the end node.
+        None if there is no path.
+        """
+        stride = self.navmap.stride
+        start_cluster = self._cluster(start)
+        end_cluster = self._cluster(end)
+        end_x, end_y = divmod(end, stride)
+
+        def heuristic(index):
+            x, y = divmod(index, stride)
+            return max(abs(x - end_x), abs(y - end_y))
+
+        # close by, search the cells of both clusters directly, the abstract route has to pass through the
+        # entrances and can be far longer. Taken straight away if it's as short as any path can be, otherwise
+        # whichever of it and the abstract route is shorter
+        direct = None
+        if abs(start_cluster[0] - end_cluster[0]) <= 1 and abs(start_cluster[1] - end_cluster[1]) <= 1:
+            parents, distance = self._search(start, start_cluster, end_cluster)
+            if end in parents:
+                direct = distance[end], _compressPath(self._trace(parents, end)[::-1], stride)
+                if direct[0] == heuristic(start):
+                    return direct[1]
+
+        start_parents, start_distance = self._search(start, start_cluster)
+        end_parents, end_distance = self._search(end, end_cluster)
+
+        # A* over the abstract graph, seeded with the start cluster entrances the start can reach (came_from -1)
+        goal_links = {}
+        for node in self.clusterNodes.get(end_cluster, []):
+            if self.nodes[node] in end_distance:
+                goal_links[node] = end_distance[self.nodes[node]]
+
+        counter = itertools.count()
+        queue = []
+        cost = {}
+        came_from = {}
+        for node in self.clusterNodes.get(start_cluster, []):
+            if self.nodes[node] in start_distance:
+                cost[node] = start_distance[self.nodes[node]]
+                came_from[node] = -1
+                heapq.heappush(queue, (cost[node] + heuristic(self.nodes[node]), next(counter), cost[node], node))
+
+        best = None
+        while queue:
+            priority, _, node_cost, node = heapq.heappop(queue)
+            if best is not None and priority >= best[0]:
+                break
+            if node_cost > cost[node]:  # superseded by a cheaper entry
+                continue
+            if node in goal_links and (best is None or cost[node] + goal_links[node] < best[0]):
+                best = cost[node] + goal_links[node], node
+            for neighbour, step in self.edges[node]:
+                new_cost = cost[node] + step
+                if neighbour not in cost or new_cost < cost[neighbour]:
+                    cost[neighbour] = new_cost
+                    came_from[neighbour] = node
+                    heapq.heappush(queue, (new_cost + heuristic(self.nodes[neighbour]), next(counter), new_cost,
+                                           neighbour))
+
+        if direct is not None and (best is None or direct[0] <= best[0]):
+            return direct[1]
+        if best is None:
+            return None
+
+        abstract = [best[1]]
+        while came_from[abstract[-1]] != -1:
+            abstract.append(came_from[abstract[-1]])
+        abstract.reverse()
+
+        # refine every hop back into cells
+        cells = self._trace(start_parents, self.nodes[abstract[0]])[::-1]
+        for a, b in zip(abstract, abstract[1:]):
+            a, b = self.nodes[a], self.nodes[b]
+            if self._cluster(a) == self._cluster(b):
+                parents, _ = self._search(a, self._cluster(a))
+                cells += self._trace(parents, b)[::-1][1:]
+            else:
+                cells.append(b)
+        cells += self._trace(end_parents, self.nodes[abstract[-1]])[1:]
+        return _compressPath(cells, stride)
+
+    def _trace(self, parents, index):
+        """ The cells from index back to the source of the search that produced parents """
+        cells = [index]
+        while parents[index] != index:
+            index = parents[index]
+            cells.append(index)
+        return cells
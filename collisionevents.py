@@ -0,0 +1,95 @@
+# Kinds of entity. The Bullet node of every entity that takes part in collision events is tagged with its kind
+# (see tag), so contacts are told apart by tag rather than by searching node names.
+PLAYER = 'player'
+ENEMY = 'enemy'
+BULLET = 'bullet'
+CRYSTAL = 'crystal'
+WALL = 'wall'
+
+# matches any kind, tagged or not, as the second kind of an event
+ANY = 'any'
+
+# Events are the kinds of the two entities in contact, handlers are called with them in this order
+BULLET_HIT_ENEMY = (BULLET, ENEMY)
+PLAYER_TOUCH_CRYSTAL = (PLAYER, CRYSTAL)
+ENEMY_TOUCH_PLAYER = (ENEMY, PLAYER)
+PLAYER_CONTACT = (PLAYER, ANY)
+
+TAG = 'entity'
+
+
+def tag(node, kind, owner=None):
+    """
+    Mark a Bullet node as an entity of kind. Copies of the node (make_copy) keep the tag.
+
+    Parameters
+    owner - what handlers are given for this entity, the node itself if None
+    """
+    node.setPythonTag(TAG, (kind, owner))
+
+
+def untag(node):
+    """ Drop the tag of a node that's done with, so it doesn't keep its owner alive """
+    node.clearPythonTag(TAG)
+
+
+class CollisionEvents:
+    """
+    Turns the contacts the physics world found into events. After every physics step dispatch() makes one pass over
+    the world's contact manifolds (every pair of bodies touching) and calls the handlers accepted for the kinds of
+    the two bodies, instead of every entity running contact tests of its own every frame.
+
+    Handlers are called as handler(a, b, points) with the owners of the two entities in the event's order and the
+    points (world space, on a's surface) where they touch, at least one. Handlers of an event with ANY get the other
+    entity's kind instead of its owner, None if it isn't tagged. Handlers run after the pass over the manifolds, so
+    they're free to remove bodies from the world.
+    """
+
+    def __init__(self, world):
+        self.world = world
+        self.handlers = {}  # event -> handlers
+
+    def accept(self, event, handler):
+        self.handlers.setdefault(event, []).append(handler)
+
+    def ignore(self, event, handler):
+        handlers = self.handlers.get(event, [])
+        if handler in handlers:
+            handlers.remove(handler)
+
+    def dispatch(self):
+        handlers = self.handlers
+        calls = []
+        for manifold in self.world.getManifolds():
+            node0 = manifold.getNode0()
+            node1 = manifold.getNode1()
+            kind0, owner0 = node0.getPythonTag(TAG) or (None, None)
+            kind1, owner1 = node1.getPythonTag(TAG) or (None, None)
+            if kind0 is None and kind1 is None:
+                continue
+            owner0 = owner0 if owner0 is not None else node0
+            owner1 = owner1 if owner1 is not None else node1
+
+            touching = None
+            for first, kindA, a, kindB, b in ((True, kind0, owner0, kind1, owner1),
+                                              (False, kind1, owner1, kind0, owner0)):
+                if kindA is None:
+                    continue
+                pair = handlers.get((kindA, kindB))
+                other = handlers.get((kindA, ANY))
+                if not pair and not other:
+                    continue
+
+                if touching is None:
+                    # the manifold also keeps points that are about to touch, only the touching ones count
+                    touching = [point for point in manifold.getManifoldPoints() if point.getDistance() <= 0]
+                if not touching:
+                    break
+                points = [point.getPositionWorldOnA() if first else point.getPositionWorldOnB() for point in touching]
+                for handler in pair or ():
+                    calls.append((handler, a, b, points))
+                for handler in other or ():
+                    calls.append((handler, a, kindB, points))
+
+        for handler, a, b, points in calls:
+            handler(a, b, points)
@@ -3,6 +3,8 @@ from direct.showbase.DirectObject import DirectObject
 from panda3d.bullet import BulletConvexHullShape, BulletRigidBodyNode
 from panda3d.core import Vec3, LPoint3, NodePath
 
+from collisionevents import CRYSTAL, tag, untag
+
 
 class CrystalObject(DirectObject):
 
@@ -10,6 +12,7 @@ class CrystalObject(DirectObject):
                  name='default'):
         DirectObject.__init__(self)
 
+        self.name = name
         self.model = base.loader.loadModel(model)
         self.model.setScale(scale.x, scale.y, scale.z)
         self.model.setPos(-self.model.getBounds().getCenter())
@@ -22,6 +25,7 @@ class CrystalObject(DirectObject):
         node = BulletRigidBodyNode(name)
         node.addShape(shape)
         node.setMass(0.01)
+        tag(node, CRYSTAL, self)
         self.np = base.render.attachNewNode(node)
         self.np.setPos(position)
         base.world.attachRigidBody(node)
@@ -67,6 +71,7 @@ class CrystalObject(DirectObject):
     def removeCrystal(self):
         if self.np.node() is not None:
             self.np.node().removeAllChildren()
+            untag(self.np.node())
             base.world.remove(self.np.node())
 
         self.removeAllTasks()
@@ -0,0 +1,94 @@
+from direct.showbase.DirectObject import DirectObject
+
+from billboardobject import BillBoardObject
+
+
+class EnemyPool(DirectObject):
+    """
+    Pre-built enemies, parked out of the world until a spawner needs one. Spawning takes a parked enemy (its card,
+    rigid body and capsule are already built) and puts it back into the world, and a dying enemy is parked again
+    instead of being thrown away.
+
+    Every type of enemy (texture and scale) prepared with prepare() starts with warmup parked enemies. After that the
+    pool keeps at least spare of them parked, building at most buildBudget a frame, so a burst of spawns finds them
+    ready instead of building them on the spot. A spawn that still finds none builds one straight away.
+    """
+
+    def __init__(self, warmup=8, spare=4, buildBudget=1, limit=None):
+        DirectObject.__init__(self)
+
+        self.warmup = warmup
+        self.spare = spare
+        self.buildBudget = buildBudget
+
+        # parked enemies kept per type, the ones released beyond it are thrown away. None keeps them all.
+        self.limit = limit
+
+        self.parked = {}  # (texture, scale) -> parked enemies
+
+        # stats
+        self.built = 0
+        self.reused = 0
+        self.missed = 0  # spawns that had to build their enemy
+
+        self.add_task(self.grow, 'enemy_pool')
+
+    def _build(self, texture, scale):
+        self.built += 1
+        return BillBoardObject(texture, None, scale, pool=self)
+
+    def prepare(self, texture, scale=1):
+        """ Build the parked enemies of a type up front, e.g. while the level loads """
+        parked = self.parked.setdefault((texture, scale), [])
+        while len(parked) < self.warmup:
+            parked.append(self._build(texture, scale))
+
+    def acquire(self, texture, position, scale=1, drop=None, pathfinder=None, pathService=None, enemySystem=None,
+                renderer=None):
+        """
+        Spawn an enemy of a type at position, see BillBoardObject.spawn
+
+        Return
+        the enemy, it comes back to the pool when it dies
+        """
+        parked = self.parked.setdefault((texture, scale), [])
+        if parked:
+            enemy = parked.pop()
+            self.reused += 1
+        else:
+            enemy = self._build(texture, scale)
+            self.missed += 1
+        enemy.spawn(position, drop, pathfinder, pathService, enemySystem, renderer)
+        return enemy
+
+    def release(self, enemy):
+        """ Park an enemy that left the world, called by BillBoardObject.removeEnemy """
+        parked = self.parked.setdefault((enemy.texture, enemy.scale), [])
+        if self.limit is not None and len(parked) >= self.limit:
+            enemy.destroy()
+        else:
+            parked.append(enemy)
+
+    def grow(self, task):
+        budget = self.buildBudget
+        for (texture, scale), parked in self.parked.items():
+            while budget > 0 and len(parked) < self.spare:
+                parked.append(self._build(texture, scale))
+                budget -= 1
+        return task.cont
+
+    def stats(self):
+        return {
+            'parked': sum(len(parked) for parked in self.parked.values()),
+            'built': self.built,
+            'reused': self.reused,
+            'missed': self.missed,
+        }
+
+    def destroy(self):
+        self.removeAllTasks()
+        self.ignoreAll()
+        for parked in self.parked.values():
+            for enemy in parked:
+                enemy.destroy()
+        self.parked.clear()
@@ -4,12 +4,19 @@ from panda3d.core import Vec3
 from direct.gui.DirectGui import *
 
 from billboardobject import BillBoardObject
+from billboardrenderer import BillboardRenderer
+from enemypool import EnemyPool
+from enemysystem import EnemySystem
+from navmapregistry import registry
 from pathfinder import Pathfinder
+from pathservice import PathService
 from resourcepath import resource_path
 
 
 class EnemySpawner():
-    def __init__(self, location: Vec3, type: str, cooldown: float):
+    def __init__(self, location: Vec3, type: str, cooldown: float, pathfinder: Pathfinder = None,
+                 pathService: PathService = None, enemySystem: EnemySystem = None, pool: EnemyPool = None,
+                 renderer: BillboardRenderer = None):
         self.location = location
         self.type = type
 
@@ -25,8 +32,23 @@ class EnemySpawner():
             self.tex.append(base.loader.loadTexture(resource_path('Assets/assets/GreenEnemy/base.png')))
             self.tex.append(base.loader.loadTexture(resource_path('Assets/assets/BlueEnemy/base.png')))
 
-        self.pathfinder = Pathfinder()
-        self.pathfinder.loadMap(resource_path('NavMeshes/defaultnavmesh.json'))
+        # spawners can share one pathfinder, e.g. a FLOW mode one so every enemy reads the same field,
+        # otherwise use our own and cache its routes since our enemies all start from the same spot
+        if pathfinder is None:
+            self.pathfinder = registry.getPathfinder(resource_path('NavMeshes/defaultnavmesh.nav'), cache_size=64)
+        else:
+            self.pathfinder = pathfinder
+
+        self.pathService = pathService
+        self.enemySystem = enemySystem
+        self.renderer = renderer
+
+        # spawn parked enemies from the pool rather than building new ones, if there is one
+        self.scale = 1.5
+        self.pool = pool
+        if self.pool is not None:
+            for tex in (self.tex if type == 'random' else [self.tex]):
+                self.pool.prepare(tex, self.scale)
 
         self.cooldown = cooldown
         self.elapsed = 0
@@ -36,7 +58,14 @@ class EnemySpawner():
         if self.elapsed >= self.cooldown:
             self.elapsed = 0
             if self.type != 'random':
-                return BillBoardObject(self.tex, self.location, scale=1.5, drop=self.type, pathfinder=self.pathfinder)
+                return self.spawn(self.tex, self.type)
             else:
                 types = ['red', 'green', 'blue']
-                return BillBoardObject(self.tex[randint(0, 2)], self.location, scale=1.5, drop=types[randint(0, 2)], pathfinder=self.pathfinder)
+                return self.spawn(self.tex[randint(0, 2)], types[randint(0, 2)])
+
+    def spawn(self, tex, drop):
+        if self.pool is not None:
+            return self.pool.acquire(tex, self.location, self.scale, drop, self.pathfinder, self.pathService,
+                                     self.enemySystem, self.renderer)
+        return BillBoardObject(tex, self.location, scale=self.scale, drop=drop, pathfinder=self.pathfinder,
+                               pathService=self.pathService, enemySystem=self.enemySystem, renderer=self.renderer)
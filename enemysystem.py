@@ -0,0 +1,235 @@
+import builtins
+
+import numpy as np
+from direct.showbase.DirectObject import DirectObject
+from direct.showbase.ShowBaseGlobal import globalClock
+from panda3d.core import Vec3
+
+from collisionevents import BULLET_HIT_ENEMY
+
+# the enemy attributes EnemySystem keeps in its arrays, the vectors as rows of 3
+VECTORS = ('target',)
+SCALARS = ('maxSpeed', 'health', 'lifetime', 'pathLifetime', 'stuckSpeed')
+
+# the arrays EnemySystem keeps for itself, one row per enemy
+INTERNAL = ('position', 'velocity', 'stamped', 'stuckTimer')
+
+# seconds an enemy has to stay below its stuckSpeed before it's stamped on the overlay, and back above it before the
+# stamp is cleared. Every stamp change invalidates the shared flow field, so brief stops (spawning, turning) don't.
+STUCK_TIME = 1.0
+UNSTUCK_TIME = 0.5
+
+# enemies this close to their target (e.g. pressed against the player) are where they want to be, not stuck
+STUCK_REACH = 2.0
+
+
+class Packed:
+    """
+    An enemy attribute kept in the EnemySystem array of the same name while the enemy is in the system, and on the
+    enemy itself before it joins and after it leaves. Reads of a vector give a Vec3.
+    """
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, enemy, owner=None):
+        if enemy is None:
+            return self
+        if enemy.slot is None:
+            return enemy.__dict__[self.name]
+        value = getattr(enemy.enemySystem, self.name)[enemy.slot]
+        return Vec3(*value) if self.name in VECTORS else float(value)
+
+    def __set__(self, enemy, value):
+        if enemy.slot is None:
+            enemy.__dict__[self.name] = value
+        elif self.name in VECTORS:
+            getattr(enemy.enemySystem, self.name)[enemy.slot] = (value[0], value[1], value[2])
+        else:
+            getattr(enemy.enemySystem, self.name)[enemy.slot] = value
+
+
+class EnemySystem(DirectObject):
+    """
+    Updates every enemy in one task instead of three tasks per enemy. Positions, velocities, targets, health and
+    lifetimes are packed into arrays (one row per enemy, in slots 0 to len(enemies) - 1) so steering, lifetimes and
+    deaths are a handful of NumPy operations over all of them. The rigid bodies are read once and pushed once a
+    frame, only the enemies that reached a waypoint or need a new path call back into their own object.
+    """
+
+    def __init__(self, capacity=64, steering=0.2, events=None):
+        DirectObject.__init__(self)
+
+        # force applied per unit of difference between an enemy's velocity and the one it wants
+        self.steering = steering
+
+        # bullet hits come from the game's CollisionEvents (base.collisionEvents if None), dispatched after each
+        # physics step. Without any, e.g. outside the game, health only changes through the health array.
+        if events is None:
+            events = getattr(getattr(builtins, 'base', None), 'collisionEvents', None)
+        self.events = events
+        if self.events is not None:
+            self.events.accept(BULLET_HIT_ENEMY, self.hit)
+
+        self.enemies = []  # slot -> enemy
+        self.capacity = 0
+        self._allocate(capacity)
+
+        # after the game's update has stepped the physics, so the positions read are the ones drawn this frame
+        self.add_task(self.update, 'enemy_system', sort=1)
+
+    def _allocate(self, capacity):
+        """ Grow every array to capacity rows, keeping the enemies already in them """
+        for name in INTERNAL + VECTORS + SCALARS:
+            if name == 'stamped':
+                array = np.zeros(capacity, dtype=bool)  # stamped on its pathfinder's overlay as stuck
+            else:
+                array = np.zeros((capacity, 3) if name in ('position', 'velocity') + VECTORS else capacity)
+            if self.capacity:
+                array[:self.capacity] = getattr(self, name)
+            setattr(self, name, array)
+        self.capacity = capacity
+
+    def add(self, enemy):
+        """ Take over updating enemy, moving its Packed attributes into the arrays """
+        slot = len(self.enemies)
+        if slot == self.capacity:
+            self._allocate(self.capacity * 2)
+
+        self.enemies.append(enemy)
+        for name in VECTORS + SCALARS:
+            value = enemy.__dict__.pop(name)
+            getattr(self, name)[slot] = (value[0], value[1], value[2]) if name in VECTORS else value
+        pos = enemy.card_physics_np.getPos()
+        self.position[slot] = (pos.x, pos.y, pos.z)
+        self.velocity[slot] = 0
+        self.stamped[slot] = False
+        self.stuckTimer[slot] = 0
+        enemy.slot = slot
+
+    def remove(self, enemy):
+        """ Stop updating enemy, its Packed attributes keep their last values """
+        slot = enemy.slot
+        if slot is None:
+            return
+        values = {name: getattr(enemy, name) for name in VECTORS + SCALARS}
+        enemy.slot = None
+        enemy.__dict__.update(values)
+
+        # the last enemy moves into the freed slot so the live rows stay packed
+        last = len(self.enemies) - 1
+        moved = self.enemies.pop()
+        if slot != last:
+            self.enemies[slot] = moved
+            moved.slot = slot
+            for name in INTERNAL + VECTORS + SCALARS:
+                array = getattr(self, name)
+                array[slot] = array[last]
+
+    def hit(self, bullet, enemy, points):
+        """ A bullet touching an enemy takes a quarter of its health per contact point """
+        if enemy.slot is not None:
+            self.health[enemy.slot] -= 0.25 * len(points)
+
+    def update(self, task):
+        # the dead drop their crystal and leave, before anything else reads their slots
+        for enemy in [self.enemies[slot] for slot in np.flatnonzero(self.health[:len(self.enemies)] < 0)]:
+            enemy.die()
+
+        enemies = self.enemies
+        count = len(enemies)
+        if count == 0:
+            return task.cont
+
+        position = self.position[:count]
+        velocity = self.velocity[:count]
+        target = self.target[:count]
+        waypoints = np.zeros(count, dtype=int)
+        routed = np.zeros(count, dtype=bool)
+
+        # read every body once
+        for slot, enemy in enumerate(enemies):
+            node = enemy.card_physics_node
+            pos = enemy.card_physics_np.getPos()
+            vel = node.getLinearVelocity()
+            position[slot] = (pos.x, pos.y, pos.z)
+            velocity[slot] = (vel.x, vel.y, vel.z)
+            if enemy.path is not None:
+                routed[slot] = True
+                waypoints[slot] = len(enemy.path) - enemy.current_node - 1
+
+        # steer straight at the target on the ground plane at maxSpeed
+        direction = target - position
+        direction[:, 2] = 0
+        distance = np.linalg.norm(direction, axis=1)
+        ideal = np.divide(direction, distance[:, None], out=np.zeros_like(direction), where=distance[:, None] > 0)
+        ideal *= self.maxSpeed[:count, None]
+        force = (ideal - velocity) * self.steering
+        force[:, 2] = 0
+
+        # push every body once
+        for slot, enemy in enumerate(enemies):
+            enemy.card_physics_node.applyCentralForce(Vec3(*force[slot]))
+
+        # stuck enemies block their cell for everyone else's searches. The timer runs while an enemy is in the
+        # state it isn't marked as yet (slow but not stamped, or moving but stamped) and flips it when it runs out.
+        speed = np.linalg.norm(velocity, axis=1)
+        slow = (speed < self.stuckSpeed[:count]) & (distance > STUCK_REACH)
+        stamped = self.stamped[:count]
+        timer = self.stuckTimer[:count]
+        switching = slow != stamped
+        timer[switching] += globalClock.getDt()
+        timer[~switching] = 0
+        flip = switching & (timer >= np.where(stamped, UNSTUCK_TIME, STUCK_TIME))
+        stamped[flip] = ~stamped[flip]
+        timer[flip] = 0
+
+        # a stamp follows its enemy while it stays put, which only rewrites cells if it edged into another one
+        for slot in np.flatnonzero(flip | (stamped & slow)):
+            enemy = enemies[slot]
+            overlay = enemy.pathfinder.overlay
+            if overlay is None:
+                continue
+            if stamped[slot]:
+                overlay.stamp(enemy, Vec3(*position[slot]) + enemy.nav_offset)
+            else:
+                overlay.clear(enemy)
+
+        self.pathLifetime[:count] -= 0.1
+
+        # the direction is from before the target moves, as it was when the force was worked out
+        for slot in np.flatnonzero((waypoints > 0) & (distance < 1.5)):
+            enemies[slot].next_waypoint()
+
+        for slot in np.flatnonzero(~routed | (self.pathLifetime[:count] < 0)):
+            enemies[slot].update_path()
+
+        # enemies that barely move run out of time, and die on the next update
+        lifetime = self.lifetime[:count]
+        expired = lifetime < 0
+        self.health[:count][expired] = -0.1
+        lifetime[~expired & (speed < 0.1)] -= 0.01
+
+        return task.cont
+
+    def clear(self):
+        for enemy in list(self.enemies):
+            enemy.removeEnemy()
+
+    def destroy(self):
+        self.clear()
+        if self.events is not None:
+            self.events.ignore(BULLET_HIT_ENEMY, self.hit)
+        self.removeAllTasks()
+        self.ignoreAll()
+
+
+_default = None
+
+
+def getEnemySystem():
+    """ The EnemySystem enemies join when they aren't given one, created on first use """
+    global _default
+    if _default is None:
+        _default = EnemySystem()
+    return _default
@@ -0,0 +1,232 @@
+import heapq
+import itertools
+import struct
+import zlib
+from array import array
+
+from direct.stdpy.file import exists, open
+
+from pathfinder import OBSTACLE
+
+# the 8 directions in table order, cardinals first so CARDINAL_OF can point back into the table
+DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1))
+
+# for each diagonal, the table slots of its x and y components
+CARDINAL_OF = {4: (0, 2), 5: (0, 3), 6: (1, 2), 7: (1, 3)}
+
+# a jump point never needs to search back the way it was reached, so only directions that don't point
+# against the arrival direction are explored from it
+FORWARD = [[e for e, (ex, ey) in enumerate(DIRECTIONS) if ex * dx + ey * dy >= 0] for dx, dy in DIRECTIONS]
+EVERY_DIRECTION = list(range(len(DIRECTIONS)))
+
+HEADER = struct.Struct('<4sIII')
+MAGIC = b'JPS+'
+VERSION = 1
+
+
+class JumpTable:
+    """
+    Precomputed jump distances for JPS+ over a NavMap's grid.
+
+    For every free cell and each of the 8 directions the table holds how many steps away the next jump point
+    is (positive), or how many free steps there are before a wall (zero or negative). A search then jumps
+    straight from jump point to jump point instead of walking the grid cell by cell.
+    """
+
+    def __init__(self, navmap):
+        self.navmap = navmap
+        self.table = None
+
+    def checksum(self):
+        """ Identifies the grid this table was built for """
+        return zlib.crc32(self.navmap.grid.tobytes())
+
+    def build(self, region=None):
+        """
+        Fill the table. With region (x0, x1, y0, y1 in cells, the ends excluded), the table already holds the
+        distances from before the cells in region changed, and only the entries the change can reach are
+        computed again.
+        """
+        pf = self.navmap
+        grid = pf.grid
+        stride = pf.stride
+        if region is None:
+            table = array('i', bytes(len(grid) * 8 * 4))
+        else:
+            table = self.table
+
+        def blocked(index):
+            return grid[index] == OBSTACLE
+
+        def forced(index, d):
+            """ Does moving in direction d onto index uncover a neighbour that needs a jump point here? """
+            dx, dy = DIRECTIONS[d]
+            if dy == 0:
+                return (blocked(index + 1) and not blocked(index + dx * stride + 1)) or \
+                       (blocked(index - 1) and not blocked(index + dx * stride - 1))
+            if dx == 0:
+                return (blocked(index + stride) and not blocked(index + stride + dy)) or \
+                       (blocked(index - stride) and not blocked(index - stride + dy))
+            return (blocked(index - dx * stride) and not blocked(index - dx * stride + dy)) or \
+                   (blocked(index - dy) and not blocked(index + dx * stride - dy))
+
+        def entry(index, d, step, cardinals):
+            n = index + step
+            if blocked(n):
+                return 0
+            if forced(n, d) or (cardinals is not None and
+                                (table[n * 8 + cardinals[0]] > 0 or table[n * 8 + cardinals[1]] > 0)):
+                return 1
+            distance = table[n * 8 + d]
+            return distance + 1 if distance > 0 else distance - 1
+
+        # sweep every direction from its far side so the next cell along it is always done first,
+        # the diagonals last as they stop wherever one of their cardinal components finds a jump point
+        if region is None:
+            for d, (dx, dy) in enumerate(DIRECTIONS):
+                step = dx * stride + dy
+                xs = range(pf.width - 1, -1, -1) if dx > 0 else range(pf.width)
+                ys = range(pf.height - 1, -1, -1) if dy > 0 else range(pf.height)
+                cardinals = CARDINAL_OF.get(d)
+                for x in xs:
+                    for y in ys:
+                        index = (x + 1) * stride + y + 1
+                        if not blocked(index):
+                            table[index * 8 + d] = entry(index, d, step, cardinals)
+            self.table = table
+            return
+
+        # an entry only depends on the cells next to the one ahead of it and that cell's entries, so start from
+        # every cell within two of region (and, for the diagonals, behind every changed cardinal entry) and walk
+        # back along each direction for as long as the entries keep changing
+        x0, x1, y0, y1 = region
+        around = [(x + 1) * stride + y + 1 for x in range(max(x0 - 2, 0), min(x1 + 2, pf.width))
+                  for y in range(max(y0 - 2, 0), min(y1 + 2, pf.height))]
+        changed = [set() for _ in DIRECTIONS]
+        for d, (dx, dy) in enumerate(DIRECTIONS):
+            step = dx * stride + dy
+            cardinals = CARDINAL_OF.get(d)
+            seeds = set(around)
+            if cardinals is not None:
+                seeds.update(index - step for index in changed[cardinals[0]] | changed[cardinals[1]]
+                             if not blocked(index - step))
+
+            # furthest along the direction first
+            for index in sorted(seeds, key=lambda i: -(i // stride * dx + i % stride * dy)):
+                first = True
+                while first or not blocked(index):
+                    value = 0 if blocked(index) else entry(index, d, step, cardinals)
+                    if value == table[index * 8 + d] and not first:
+                        break
+                    if value != table[index * 8 + d]:
+                        table[index * 8 + d] = value
+                        changed[d].add(index)
+                    first = False
+                    index -= step
+
+    def patched(self, navmap, region):
+        """
+        The table for navmap, a copy of this table's map with the cells in region (x0, x1, y0, y1, the ends
+        excluded) changed. Only the entries the change can reach are computed again.
+        """
+        table = JumpTable(navmap)
+        table.table = array('i', self.table)
+        table.build(region)
+        return table
+
+    def save(self, name):
+        with open(name, 'wb') as outfile:
+            outfile.write(HEADER.pack(MAGIC, VERSION, self.checksum(), len(self.table)))
+            outfile.write(self.table.tobytes())
+
+    def load(self, name):
+        """
+        Load a table saved by save(), only if it was built for the current grid.
+
+        Return
+        True if the table was loaded
+        """
+        if not exists(name):
+            return False
+        try:
+            with open(name, 'rb') as f:
+                data = f.read()
+            magic, version, checksum, count = HEADER.unpack_from(data)
+        except:
+            return False
+        if magic != MAGIC or version != VERSION or checksum != self.checksum() or \
+                count != len(self.navmap.grid) * 8:
+            return False
+
+        table = array('i')
+        table.frombytes(data[HEADER.size:HEADER.size + count * table.itemsize])
+        self.table = table
+        return True
+
+    def getPath(self, start, end):
+        """
+        A* over jump points between the free cells with flat indices start and end.
+
+        Return
+        a list of jump points as 2-tuples (coordinates) starting from the start node and finishing at the end node.
+        None if there is no path.
+        """
+        stride = self.navmap.stride
+        table = self.table
+        end_x, end_y = divmod(end, stride)
+
+        cost = {start: 0}
+        came_from = {start: start}
+        arrival = {start: None}
+        counter = itertools.count()
+        queue = [(0, next(counter), 0, start)]
+        while queue:
+            _, _, node_cost, node = heapq.heappop(queue)
+            if node_cost > cost[node]:  # superseded by a cheaper entry
+                continue
+            if node == end:
+                result = []
+                while node != start:
+                    result.append((node // stride - 1, node % stride - 1))
+                    node = came_from[node]
+                result.reverse()
+                return [(start // stride - 1, start % stride - 1)] + result
+
+            x, y = divmod(node, stride)
+            diff_x = end_x - x
+            diff_y = end_y - y
+            directions = EVERY_DIRECTION if arrival[node] is None else FORWARD[arrival[node]]
+            for d in directions:
+                dx, dy = DIRECTIONS[d]
+                distance = table[node * 8 + d]
+                successor = None
+
+                if dx == 0 or dy == 0:
+                    # the goal sits on this line, closer than the next jump point or wall
+                    if (dy == 0 and diff_y == 0 and diff_x * dx > 0 and abs(diff_x) <= abs(distance)) or \
+                            (dx == 0 and diff_x == 0 and diff_y * dy > 0 and abs(diff_y) <= abs(distance)):
+                        steps = abs(diff_x) + abs(diff_y)
+                        successor = end
+                    elif distance > 0:
+                        steps = distance
+                        successor = node + distance * (dx * stride + dy)
+                else:
+                    # heading into the goal's quadrant, stop where the goal is straight ahead on one axis
+                    steps = min(abs(diff_x), abs(diff_y))
+                    if diff_x * dx > 0 and diff_y * dy > 0 and steps <= abs(distance):
+                        successor = node + steps * (dx * stride + dy)
+                    elif distance > 0:
+                        steps = distance
+                        successor = node + distance * (dx * stride + dy)
+
+                if successor is None:
+                    continue
+                new_cost = node_cost + steps
+                if successor not in cost or new_cost < cost[successor]:
+                    cost[successor] = new_cost
+                    came_from[successor] = node
+                    arrival[successor] = d
+                    s_x, s_y = divmod(successor, stride)
+                    heuristic = max(abs(end_x - s_x), abs(end_y - s_y))
+                    heapq.heappush(queue, (new_cost + heuristic, next(counter), new_cost, successor))
+        return None
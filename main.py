@@ -17,9 +17,17 @@ from interactableobject import InteractableObject
 from pipeline import CustomPipeline
 from playercontroller import PlayerController
 from billboardobject import BillBoardObject
+from billboardrenderer import BillboardRenderer
+from collisionevents import CollisionEvents, WALL, tag
 from pausemenu import PauseMenu
 
+from enemypool import EnemyPool
 from enemyspawner import EnemySpawner
+from enemysystem import EnemySystem
+from navmapregistry import registry
+from navoverlay import NavOverlay
+from pathfinder import FLOW
+from pathservice import PathService
 from resourcepath import resource_path
 from startscreen import StartScreen
 from math import sin, cos, radians
@@ -49,6 +57,7 @@ class MyApp(ShowBase):
         # World
         self.world = BulletWorld()
         self.world.setGravity(Vec3(0, 0, -9.81))
+        self.collisionEvents = CollisionEvents(self.world)
         self.worldNP = self.render.attachNewNode(BulletRigidBodyNode('World'))
 
         if DEBUG:
@@ -63,7 +72,7 @@ class MyApp(ShowBase):
 
         # Disable the camera trackball controls.
         self.disableMouse()
-        self.player = PlayerController(self.camera, self.win)
+        self.player = PlayerController(self.camera, self.win, events=self.collisionEvents)
 
         self.player.setPos(self.camera.getPos() - Vec3(0, 20, 0))
 
@@ -103,6 +112,7 @@ class MyApp(ShowBase):
         mesh.addGeom(geom)
         shape = BulletTriangleMeshShape(mesh, dynamic=False)
         node = BulletRigidBodyNode('Walls')
+        tag(node, WALL)
         node.addShape(shape)
         self.np = self.render.attachNewNode(node)
         self.world.attachRigidBody(node)
@@ -166,16 +176,48 @@ class MyApp(ShowBase):
             np.setPos(0, 0, -0.4)
             self.world.attachRigidBody(node)
 
+        # before the registry maps the nav map file below, Windows won't replace a mapped file
+        if GENERATE_NAVMESH:
+            navMesh = NavMeshGenerator()
+            navMesh.gridSize = 100
+            navMesh.xstep = 1
+            navMesh.ystep = 1
+            navMesh.bottomLeftCorner = Vec3(-50, -50, 3)
+            navMesh.bitMask = BitMask32().allOn()
+            navMesh.scene = self.world
+            navMesh.generate()
+            self.userExit()
+
         # Add Billboard Enemies
         self.enemiesLimit = 10
         self.enemies = []
         self.enemySpawners = []
-        self.enemySpawners.append(EnemySpawner(Vec3(-36.5, -35.4, 2.1), "random", 2))
-        self.enemySpawners.append(EnemySpawner(Vec3(36.5, -35.4, 2.1), "random", 2))
-        self.enemySpawners.append(EnemySpawner(Vec3(-36.5, 35.4, 2.1), "random", 2))
-        self.enemySpawners.append(EnemySpawner(Vec3(36.5, 35.4, 2.1), "random", 2))
-        self.enemySpawners.append(EnemySpawner(Vec3(43, 0, 2.1), "random", 2))
-        self.enemySpawners.append(EnemySpawner(Vec3(-43, 0, 2.1), "random", 2))
+
+        # every enemy chases the player, so they all share one flow field toward them
+        self.pathfinder = registry.getPathfinder(resource_path('NavMeshes/defaultnavmesh.nav'), mode=FLOW,
+                                                  clearance=2)
+        # stuck enemies and other moving obstacles are stamped here, before the service's workers copy the setup
+        self.navOverlay = NavOverlay(self.pathfinder.navmap)
+        self.pathfinder.useOverlay(self.navOverlay)
+        self.pathService = PathService(self.pathfinder)
+        # steers every enemy in one task
+        self.enemySystem = EnemySystem(events=self.collisionEvents)
+        # enemies are built while the level loads and recycled when they die
+        self.enemyPool = EnemyPool(warmup=8)
+        # one instanced draw call per enemy texture, each enemy draws its own card where that isn't supported
+        self.billboardRenderer = BillboardRenderer(self.enemySystem) if BillboardRenderer.isSupported() else None
+        self.enemySpawners.append(EnemySpawner(Vec3(-36.5, -35.4, 2.1), "random", 2, self.pathfinder, self.pathService,
+                                               self.enemySystem, self.enemyPool, self.billboardRenderer))
+        self.enemySpawners.append(EnemySpawner(Vec3(36.5, -35.4, 2.1), "random", 2, self.pathfinder, self.pathService,
+                                               self.enemySystem, self.enemyPool, self.billboardRenderer))
+        self.enemySpawners.append(EnemySpawner(Vec3(-36.5, 35.4, 2.1), "random", 2, self.pathfinder, self.pathService,
+                                               self.enemySystem, self.enemyPool, self.billboardRenderer))
+        self.enemySpawners.append(EnemySpawner(Vec3(36.5, 35.4, 2.1), "random", 2, self.pathfinder, self.pathService,
+                                               self.enemySystem, self.enemyPool, self.billboardRenderer))
+        self.enemySpawners.append(EnemySpawner(Vec3(43, 0, 2.1), "random", 2, self.pathfinder, self.pathService,
+                                               self.enemySystem, self.enemyPool, self.billboardRenderer))
+        self.enemySpawners.append(EnemySpawner(Vec3(-43, 0, 2.1), "random", 2, self.pathfinder, self.pathService,
+                                               self.enemySystem, self.enemyPool, self.billboardRenderer))
 
         self.light = self.render.attachNewNode(Spotlight("Sun"))
         self.light.node().setScene(self.render)
@@ -207,17 +249,6 @@ class MyApp(ShowBase):
 
         self.add_task(self.update, 'update')
 
-        if GENERATE_NAVMESH:
-            navMesh = NavMeshGenerator()
-            navMesh.gridSize = 100
-            navMesh.xstep = 1
-            navMesh.ystep = 1
-            navMesh.bottomLeftCorner = Vec3(-50, -50, 3)
-            navMesh.bitMask = BitMask32().allOn()
-            navMesh.scene = self.world
-            navMesh.generate()
-            self.userExit()
-
         # Start Screen
         self.pauseMenu = PauseMenu(self)
         self.pauseMenu.lock_keys_mouse()
@@ -241,6 +272,7 @@ class MyApp(ShowBase):
         for enemy in self.enemies:
             enemy.removeEnemy()
         self.enemies.clear()
+        self.navOverlay.clearAll()
 
     # Update
     def update(self, task):
@@ -252,6 +284,7 @@ class MyApp(ShowBase):
             return task.cont
         dt = globalClock.getDt()
         self.world.doPhysics(dt)
+        self.collisionEvents.dispatch()
 
         ''' This a neat effect but idk if we want it
         colorMag = Vec3(self.player.r, self.player.g, self.player.b).length()
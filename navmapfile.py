@@ -0,0 +1,223 @@
+# The binary nav map is a fixed size header followed by the padded occupancy grid exactly as NavMap keeps it
+# in memory, one signed byte per cell, so it can be memory-mapped and searched without parsing anything.
+import argparse
+import builtins
+import csv
+import json
+import mmap
+import os
+import shutil
+import struct
+import time
+from array import array
+
+from direct.stdpy.file import open
+from panda3d.core import Filename
+
+from pathfinder import NavMap, FREE, WALL, OBSTACLE, readNavMap
+
+# magic, version, flags, width, height, origin x, y, z, cell size
+HEADER = struct.Struct('<4sHHIIffff')
+MAGIC = b'NAVM'
+VERSION = 1
+
+
+def isBinaryNavMap(name):
+    try:
+        with open(name, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except:
+        return False
+
+
+def saveBinaryNavMap(navmap, name):
+    origin = navmap.origin if navmap.origin is not None else (0, 0, 0)
+    with open(name, 'wb') as outfile:
+        outfile.write(HEADER.pack(MAGIC, VERSION, 0, navmap.width, navmap.height,
+                                  origin[0], origin[1], origin[2], navmap.cell_size))
+        outfile.write(navmap.grid.tobytes())
+
+
+def writeBinaryNavMap(outfile, width, height, columns, origin=None, cell_size=1.0):
+    """
+    Stream a binary nav map into the open file outfile one column at a time, so the whole grid never has to be
+    in memory at once.
+
+    Parameters
+    columns - yields width bytes-like columns of height cells each (signed bytes, FREE or WALL)
+    """
+    origin = origin if origin is not None else (0, 0, 0)
+    outfile.write(HEADER.pack(MAGIC, VERSION, 0, width, height, origin[0], origin[1], origin[2], cell_size))
+
+    # the one cell wall border NavMap pads its grid with
+    border = (array('b', [OBSTACLE]) * (height + 2)).tobytes()
+    edge = array('b', [OBSTACLE]).tobytes()
+    outfile.write(border)
+    for column in columns:
+        outfile.write(edge)
+        outfile.write(column)
+        outfile.write(edge)
+    outfile.write(border)
+
+
+def replaceBinaryNavMap(temppath, name):
+    """
+    Move the finished map file temppath over the map file name. Windows won't replace a file that is memory-mapped
+    (by a running game, or by a registry that hasn't released it), its bytes are then written over the file in
+    place instead, so release the map through NavMapRegistry.release first.
+    """
+    path = Filename(name).toOsSpecific()
+    try:
+        os.replace(temppath, path)
+    except PermissionError:
+        with builtins.open(temppath, 'rb') as source:
+            data = source.read()
+        with builtins.open(path, 'r+b') as f:
+            f.write(data)
+            if f.tell() != os.fstat(f.fileno()).st_size:
+                f.truncate()
+        os.remove(temppath)
+
+
+def patchBinaryNavMap(name, x, y, columns):
+    """
+    Write a block of cells over a binary nav map file, e.g. a region NavMeshGenerator probed again. The block
+    goes into a copy that then replaces the file (see replaceBinaryNavMap, release maps loaded from it through
+    NavMapRegistry.release first), so maps already memory-mapped from it keep the cells they were loaded with,
+    patch them with NavMapRegistry.patch (or reload them) to pick up the block.
+
+    Parameters
+    x, y - the map cell the block starts at
+    columns - the block's columns, bytes-like runs of signed cells (FREE or WALL) from y upward
+    """
+    path = Filename(name).toOsSpecific()
+    temppath = path + '.tmp'
+    shutil.copyfile(path, temppath)
+    try:
+        with builtins.open(temppath, 'r+b') as f:
+            magic, version, flags, width, height = HEADER.unpack(f.read(HEADER.size))[:5]
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("Not a binary nav map " + str(name))
+            stride = height + 2
+            for cx, column in zip(range(x, width), columns):
+                f.seek(HEADER.size + (cx + 1) * stride + y + 1)
+                f.write(bytes(column)[:max(height - y, 0)])
+    except:
+        os.remove(temppath)
+        raise
+    replaceBinaryNavMap(temppath, name)
+
+
+def loadBinaryNavMap(name):
+    """
+    Memory-map a binary nav map, the NavMap grid is a read-only view straight into the file. Files that can't
+    be mapped (e.g. inside a multifile) are read into memory instead.
+
+    Return
+    a NavMap, None if name isn't a valid binary nav map
+    """
+    try:
+        with builtins.open(Filename(name).toOsSpecific(), 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except:
+        try:
+            with open(name, 'rb') as f:
+                data = f.read()
+        except:
+            return None
+
+    if len(data) < HEADER.size:
+        return None
+    magic, version, flags, width, height, x, y, z, cell_size = HEADER.unpack_from(data)
+    size = (width + 2) * (height + 2)
+    if magic != MAGIC or version != VERSION or len(data) < HEADER.size + size:
+        return None
+
+    grid = memoryview(data)[HEADER.size:HEADER.size + size].cast('b')
+    navmap = NavMap.fromGrid(grid, width, height, name, (x, y, z), cell_size)
+    navmap.buffer = data  # keep the mapping alive as long as the map
+    return navmap
+
+
+def readCsvNavMap(name):
+    """
+    Convert the legacy CSV written by NavMeshGenerator. Every center row in it is a cell that hit something,
+    i.e. a wall, and the rows hold enough to recover the grid size, cell size and origin.
+    """
+    with open(name) as f:
+        rows = csv.reader(f)
+        size = float(next(rows)[1])
+        next(rows)
+
+        walls = []
+        xstep = ystep = 1.0
+        origin = None
+        for row in rows:
+            # center rows have NULL and NodeType 0, the 8 neighbour rows after each one don't
+            if row[0] != '0' or row[1] != '0':
+                continue
+            x, y = int(row[2]), int(row[3])
+            xstep, ystep = float(row[4]), float(row[5])
+            origin = (float(row[7]) - x * xstep, float(row[8]) - y * ystep, float(row[9]))
+            walls.append((x, y))
+
+    nav_map = [[FREE for y in range(int(size / ystep))] for x in range(int(size / xstep))]
+    for x, y in walls:
+        nav_map[x][y] = WALL
+    return NavMap(nav_map, name, origin, xstep)
+
+
+def convert(source, destination, origin=None, cell_size=None):
+    """ Convert a JSON, image or CSV nav map into a binary one """
+    if str(source).lower().endswith('.csv'):
+        navmap = readCsvNavMap(source)
+    else:
+        navmap = readNavMap(source)
+    if navmap is None:
+        raise ValueError("Can't load map " + str(source))
+
+    if origin is not None:
+        navmap.origin = origin
+    if cell_size is not None:
+        navmap.cell_size = cell_size
+    saveBinaryNavMap(navmap, destination)
+    return navmap
+
+
+def benchmark(json_file, binary_file, repeat=50):
+    """ Time loading the same map from JSON (json.load + packing) and from the binary format (mmap) """
+    def timeit(load):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            load()
+        return (time.perf_counter() - start) / repeat
+
+    def fromJson():
+        with open(json_file) as f:
+            return NavMap(json.load(f))
+
+    parse = timeit(lambda: json.load(open(json_file)))
+    full = timeit(fromJson)
+    binary = timeit(lambda: loadBinaryNavMap(binary_file))
+    print('json.load          %8.3f ms' % (parse * 1000))
+    print('json.load + pack   %8.3f ms' % (full * 1000))
+    print('binary (mmap)      %8.3f ms  %.1fx faster' % (binary * 1000, full / binary if binary else 0))
+    return {'json': parse, 'json_pack': full, 'binary': binary}
+
+
+if __name__ == '__main__':
+    # e.g. python navmapfile.py NavMeshes/defaultnavmesh.json NavMeshes/defaultnavmesh.nav --origin -50 -50 3
+    parser = argparse.ArgumentParser(description='Convert nav maps to the binary format or benchmark loading them.')
+    parser.add_argument('source', help='JSON, PNG or CSV nav map (the JSON map with --benchmark)')
+    parser.add_argument('destination', help='binary nav map to write (or read with --benchmark)')
+    parser.add_argument('--origin', type=float, nargs=3, metavar=('X', 'Y', 'Z'), help='world position of cell 0, 0')
+    parser.add_argument('--cell-size', type=float, help='world size of one cell')
+    parser.add_argument('--benchmark', action='store_true', help='compare load times instead of converting')
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.source, args.destination, args.repeat)
+    else:
+        navmap = convert(args.source, args.destination, args.origin, args.cell_size)
+        print('Wrote %dx%d map to %s' % (navmap.width, navmap.height, args.destination))
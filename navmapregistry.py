@@ -0,0 +1,111 @@
+from weakref import WeakSet
+
+from pathfinder import Pathfinder, JPS, HPA, JPS_PLUS, VISIBILITY, readNavMap
+
+
+class NavMapRegistry:
+    """
+    Loads every nav map once and hands out Pathfinder views over the one shared copy. Each view only owns
+    its own scratch buffers, so views are cheap to create. Every live view can be moved onto a new version
+    of its map at once with reload().
+    """
+
+    def __init__(self):
+        self.maps = {}  # map file -> NavMap
+        self.views = {}  # map file -> the pathfinders searching it
+
+    def getMap(self, map_file):
+        """ The shared NavMap for map_file, loading it on first use. None if it can't be loaded """
+        if map_file not in self.maps:
+            navmap = readNavMap(map_file)
+            if navmap is None:
+                return None
+            self.maps[map_file] = navmap
+            self.views.setdefault(map_file, WeakSet())
+        return self.maps[map_file]
+
+    def getPathfinder(self, map_file, mode=JPS, cache_size=0, cluster_size=10, clearance=0):
+        """ A new Pathfinder searching the shared copy of map_file """
+        pathfinder = Pathfinder(mode=mode, cache_size=cache_size, cluster_size=cluster_size, clearance=clearance)
+        navmap = self.getMap(map_file)
+        if navmap is not None:
+            pathfinder.useMap(navmap)
+            self.views[map_file].add(pathfinder)
+        return pathfinder
+
+    def reload(self, map_file, nav_map=None):
+        """
+        Hot swap map_file: read it again (or use the list of lists nav_map instead) and move every live
+        pathfinder over to the new version.
+
+        Return
+        True if the new map was loaded
+        """
+        navmap = readNavMap(map_file if nav_map is None else nav_map)
+        if navmap is None:
+            return False
+        navmap.name = map_file
+
+        self.maps[map_file] = navmap
+        for pathfinder in list(self.views.setdefault(map_file, WeakSet())):
+            pathfinder.useMap(navmap)
+        return True
+
+    def release(self, map_file):
+        """
+        Move every live pathfinder on map_file onto an in-memory copy of the loaded map (its precomputed data comes
+        along), so nothing searches the file's memory mapping any more. Do this before NavMeshGenerator writes the
+        file again: on Windows a mapped file can't be replaced and is written in place, under the mapped map.
+        Then reload() or patch() as usual.
+
+        Return
+        True if map_file is loaded
+        """
+        if map_file not in self.maps:
+            return False
+        navmap, changed = self.maps[map_file].patched(0, 0, ())
+        self.maps[map_file] = navmap
+        for pathfinder in list(self.views.setdefault(map_file, WeakSet())):
+            pathfinder.useMap(navmap, changed)
+        return True
+
+    def patch(self, map_file, x, y, columns):
+        """
+        Write a block of cells over the loaded map_file, e.g. a region NavMeshGenerator.regenerate probed again,
+        and move every live pathfinder over to the patched copy. Precomputed data is only rebuilt around the
+        block, and cached paths and flow fields only dropped where they cross it.
+
+        Parameters
+        x, y - the map cell the block starts at
+        columns - the block's columns, bytes-like runs of signed cells (FREE or WALL) from y upward
+
+        Return
+        True if map_file is loaded and was patched
+        """
+        if map_file not in self.maps:
+            return False
+        navmap, changed = self.maps[map_file].patched(x, y, columns)
+        self.maps[map_file] = navmap
+        for pathfinder in list(self.views.setdefault(map_file, WeakSet())):
+            pathfinder.useMap(navmap, changed)
+
+        # keep the saved HPA graphs, JPS+ table and visibility graphs in step with the patched map file
+        for key, data in navmap.derived.items():
+            if key == JPS_PLUS:
+                cache_file = navmap.cacheFile('.jps')
+            elif isinstance(key, tuple) and key[0] == HPA:
+                cache_file = navmap.cacheFile('.hpa.json')
+            elif isinstance(key, tuple) and key[0] == VISIBILITY:
+                cache_file = navmap.cacheFile('.vis%d.json' % key[1] if key[1] else '.vis.json')
+            else:
+                continue
+            if cache_file is not None:
+                try:
+                    data.save(cache_file)
+                except:
+                    print("Can't save precomputed data next to the map!")
+        return True
+
+
+# the process-wide registry
+registry = NavMapRegistry()
@@ -1,39 +1,288 @@
+import argparse
 import csv
+import math
+import os
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
              
 from panda3d.core import *
+from panda3d.bullet import BulletWorld, BulletRigidBodyNode, BulletTriangleMesh, BulletTriangleMeshShape, \
+    BulletConvexHullShape
+
+from navmapfile import writeBinaryNavMap, patchBinaryNavMap, replaceBinaryNavMap
+from pathfinder import FREE, WALL, OBSTACLE, readNavMap
+from resourcepath import resource_path
+
+# the arena exactly as main.py builds it: both models scaled by MAP_SCALE, one copy of the pillar at each position
+MAP_SCALE = 4
+WALL_MODEL = 'Assets/assets/Mapv2/Walls/wall.bam'
+PILLAR_MODEL = 'Assets/assets/Mapv2/Pillar/pillar.bam'
+PILLAR_OFFSET = Vec3(-26, 28.33, 2.1)
+PILLAR_POSITIONS = [Vec3(0, 0, 0)] + [Vec3(x, y, 2.1) - PILLAR_OFFSET
+                                      for x, y in ((26, 28.33), (26, -28.33), (-26, -28.33), (0, 0))]
+
+# the 8 probe directions of every cell
+DIRECTIONS = [[1, -1], [1, 0], [1, 1], [0, 1],
+              [-1, 1], [-1, 0], [-1, -1], [0, -1]]
+
+
+def loadMapModel(path):
+    """ Load one of the map models the way main.py does: scaled, flattened and without its model nodes """
+    model = NodePath(Loader.getGlobalPtr().loadSync(Filename(resource_path(path))))
+    model.setScale(MAP_SCALE, MAP_SCALE, MAP_SCALE)
+    model.clear_model_nodes()
+    model.flatten_strong()
+    return model
+
+
+def buildCollisionWorld():
+    """ A BulletWorld holding only the walls and pillars, no window or ShowBase needed """
+    world = BulletWorld()
+
+    walls = loadMapModel(WALL_MODEL)
+    mesh = BulletTriangleMesh()
+    mesh.addGeom(walls.findAllMatches('**/+GeomNode')[0].node().getGeom(0))
+    node = BulletRigidBodyNode('Walls')
+    node.addShape(BulletTriangleMeshShape(mesh, dynamic=False))
+    world.attachRigidBody(node)
+
+    pillar = loadMapModel(PILLAR_MODEL)
+    shape = BulletConvexHullShape()
+    shape.addGeom(pillar.findAllMatches('**/+GeomNode')[0].node().getGeom(0))
+    for position in PILLAR_POSITIONS:
+        node = BulletRigidBodyNode('Pillar')
+        node.addShape(shape)
+        NodePath(node).setPos(position)
+        world.attachRigidBody(node)
+    return world
+
+
+def probeCell(scene, x, y, xstep, ystep, corner, mask=BitMask32.allOn()):
+    """ Does any of the 8 rays from cell x, y to its neighbours hit something in scene that collides with mask? """
+    start = Vec3(x * xstep + corner[0], y * ystep + corner[1], corner[2])
+    for dir in DIRECTIONS:
+        end = Vec3((xstep * dir[0]) + start.x, (ystep * dir[1]) + start.y, start.z)
+        if scene.rayTestClosest(start, end, mask).hasHit():
+            return True
+    return False
+
+
+def bodyBounds(body):
+    """
+    The world space box around the shapes of a Bullet body (a node or a NodePath to one), e.g. to regenerate the
+    nav map where a pillar was and where it is now.
+
+    Return
+    the low and high corners as Vec3s
+    """
+    nodePath = body if isinstance(body, NodePath) else NodePath.anyPath(body)
+    bounds = nodePath.node().getShapeBounds()
+    mat = nodePath.getNetTransform().getMat()
+    center = mat.xformPoint(bounds.getCenter())
+    radius = mat.xformVec(Vec3(bounds.getRadius(), 0, 0)).length()
+    return center - Vec3(radius, radius, radius), center + Vec3(radius, radius, radius)
+
+
+# every worker process probes its own copy of the collision world
+_world = None
+
+
+def _initWorker():
+    global _world
+    _world = buildCollisionWorld()
+
+
+def _probeTile(tile, xstep, ystep, corner, mask):
+    """ The cells of tile (x0, x1, y0, y1) that hit something, mask is the bit mask's word """
+    x0, x1, y0, y1 = tile
+    mask = BitMask32(mask)
+    return [(x, y) for x in range(x0, x1) for y in range(y0, y1)
+            if probeCell(_world, x, y, xstep, ystep, corner, mask)]
+
 
 class NavMeshGenerator():
     def __init__(self):
         self.dirname = 'NavMeshes'
-        self.basename = 'defaultnavmesh.csv'
+        self.basename = 'defaultnavmesh.nav'
+        self.legacyCsv = False  # also write the old CSV format next to the map
         self.gridSize = 10 # default 10x10 grid
         self.xstep = 5
         self.ystep = self.xstep
         self.bottomLeftCorner = LVecBase3f(0, 0, 0)
         self.bitMask = BitMask32().all_off()
         self.scene = None
-        
+
+        # with workers > 0 the raycasts are split into tileSize x tileSize tiles over that many processes, each
+        # probing its own world built from the map models (scene is not used then). Only start workers from
+        # a script that is guarded by if __name__ == '__main__'.
+        self.workers = 0
+        self.tileSize = 32
+
+        # with rasterize set the wall and pillar triangles (triangles, the map models if None) are rasterized
+        # inside heightBand (see navrasterizer) instead of raycasting a scene, and the bit mask is not used
+        self.rasterize = False
+        self.heightBand = (1, 4)
+        self.triangles = None
+
     @property
     def filepath(self):
         return Filename(self.dirname, self.basename)
 
+    @property
+    def csvFilepath(self):
+        return Filename(self.dirname, os.path.splitext(self.basename)[0] + '.csv')
+
+    def probe(self, width, height, region=None):
+        """
+        Raycast every cell of a width x height grid (or only the cells in region, x0, x1, y0, y1 with the ends
+        excluded), in this process against scene (base.world by default) or split into tiles over the worker
+        processes. With rasterize set the triangles are rasterized instead.
+
+        Return
+        a set of the x, y cells that hit something
+        """
+        xstep = self.xstep
+        ystep = self.ystep
+        corner = (self.bottomLeftCorner[0], self.bottomLeftCorner[1], self.bottomLeftCorner[2])
+        x0, x1, y0, y1 = region if region is not None else (0, width, 0, height)
+
+        if self.rasterize:
+            from navrasterizer import mapTriangles, rasterize
+
+            if self.triangles is None:
+                self.triangles = mapTriangles()
+            nav_map = rasterize(self.triangles, width, height, corner, xstep, self.heightBand,
+                                region=(x0, x1, y0, y1))
+            return {(x, y) for x in range(x0, x1) for y in range(y0, y1) if nav_map[x][y] == WALL}
+
+        if self.workers <= 0:
+            if self.scene is None:
+                self.scene = base.world
+            return {(x, y) for x in range(x0, x1) for y in range(y0, y1)
+                    if probeCell(self.scene, x, y, xstep, ystep, corner, self.bitMask)}
+
+        tiles = [(x, min(x + self.tileSize, x1), y, min(y + self.tileSize, y1))
+                 for x in range(x0, x1, self.tileSize) for y in range(y0, y1, self.tileSize)]
+        walls = set()
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_initWorker) as pool:
+            for hits in pool.map(_probeTile, tiles, [xstep] * len(tiles), [ystep] * len(tiles),
+                                 [corner] * len(tiles), [self.bitMask.getWord()] * len(tiles)):
+                walls.update(hits)
+        return walls
+
     def generate(self):
-        def gridElement_to_x_y(gridElement):
-            xy = gridElement.split('x')
-            x = int(xy[0])
-            y = int(xy[1])
-            return x, y
-        
+        """
+        Probe the grid and stream it to filepath in the pathfinder's binary format, and to the old CSV format
+        next to it if legacyCsv is set. The file is replaced rather than rewritten, so maps already loaded from it
+        stay valid, reload them with NavMapRegistry.reload to pick up the new one. On Windows release them with
+        NavMapRegistry.release first.
+
+        Return
+        the probed grid, one byte per cell at x*height + y, 1 for a wall
+        """
         self.filepath.make_dir()
 
-        size = self.gridSize
+        width = int(self.gridSize/self.xstep)
+        height = int(self.gridSize/self.ystep)
+
+        # one byte per cell, cell x, y at x*height + y, so any neighbour is a bounds check and an index away.
+        # Without a bit mask nothing is probed and every cell is kept as a wall, like the CSV always did.
+        walls = bytearray(width * height)
+        if self.rasterize or self.bitMask.getNumOnBits() > 0:
+            for x, y in self.probe(width, height):
+                walls[x*height + y] = 1
+        else:
+            walls = bytearray(b'\x01') * (width * height)
+
+        # maps the 0/1 bytes straight to the pathfinder's FREE/WALL cells
+        cells = bytearray(256)
+        cells[0] = FREE & 0xff
+        cells[1] = WALL & 0xff
+
+        # written next to the map and swapped in, a map still memory-mapped from the old file keeps reading it
+        # (except on Windows, see replaceBinaryNavMap)
+        corner = LVecBase3f(self.bottomLeftCorner)
+        temppath = Filename(self.dirname, self.basename + '.tmp')
+        with open(temppath, 'wb') as outfile:
+            columns = (walls[x*height:(x + 1)*height].translate(cells) for x in range(width))
+            writeBinaryNavMap(outfile, width, height, columns, (corner.x, corner.y, corner.z), self.xstep)
+        replaceBinaryNavMap(temppath.toOsSpecific(), self.filepath)
+
+        if self.legacyCsv:
+            self.writeCsv(walls, width, height)
+        return walls
+
+    def cellRegion(self, low, high):
+        """
+        The cells whose probes reach into the world space box between the corners low and high.
+
+        Return
+        x0, x1, y0, y1 with the ends excluded, empty if the box is off the grid
+        """
+        width = int(self.gridSize/self.xstep)
+        height = int(self.gridSize/self.ystep)
+        corner = LVecBase3f(self.bottomLeftCorner)
+
+        # a cell's rays run one step out from it in every direction
+        x0 = max(math.ceil((low[0] - corner.x) / self.xstep) - 1, 0)
+        x1 = min(math.floor((high[0] - corner.x) / self.xstep) + 2, width)
+        y0 = max(math.ceil((low[1] - corner.y) / self.ystep) - 1, 0)
+        y1 = min(math.floor((high[1] - corner.y) / self.ystep) + 2, height)
+        return x0, max(x1, x0), y0, max(y1, y0)
+
+    def regenerate(self, low, high):
+        """
+        Probe only the cells around the world space box between the corners low and high, e.g. where cover was
+        added, and patch them into the map at filepath. Maps already loaded from the file keep their old cells,
+        hand the result to NavMapRegistry.patch to update them (on Windows release them with
+        NavMapRegistry.release first). The legacy CSV is not patched.
+
+        Return
+        the patch as the map cell x, y it starts at and its columns of cells, None if the box is off the grid
+        """
+        x0, x1, y0, y1 = self.cellRegion(low, high)
+        if x0 == x1 or y0 == y1:
+            return None
+
+        if self.rasterize or self.bitMask.getNumOnBits() > 0:
+            walls = self.probe(int(self.gridSize/self.xstep), int(self.gridSize/self.ystep), (x0, x1, y0, y1))
+        else:
+            walls = None
+        columns = [array('b', [WALL if walls is None or (x, y) in walls else FREE for y in range(y0, y1)]).tobytes()
+                   for x in range(x0, x1)]
+
+        patchBinaryNavMap(self.filepath, x0, y0, columns)
+        return x0, y0, columns
+
+    def regenerateAround(self, bodies, margin=0):
+        """
+        regenerate() around where each of bodies (Bullet nodes or NodePaths to them) is now, widened by margin.
+        For a body that moved, regenerate() its old bodyBounds() as well.
+
+        Return
+        a list of the patches
+        """
+        patches = []
+        for body in bodies:
+            low, high = bodyBounds(body)
+            patch = self.regenerate(low - Vec3(margin, margin, 0), high + Vec3(margin, margin, 0))
+            if patch is not None:
+                patches.append(patch)
+        return patches
+
+    def writeCsv(self, walls, width, height):
+        """ The old CSV export, with walls as generate() probed them """
         xstep = self.xstep
         ystep = self.ystep
         bottomLeftCorner = LVecBase3f(self.bottomLeftCorner)
-        
-        with open(self.filepath, 'w') as csvfile:
+
+        def row(x, y):
+            return ['0', '0', x, y, xstep, ystep, 0, x*xstep + bottomLeftCorner.x, y*ystep + bottomLeftCorner.y, 0 + bottomLeftCorner.z]
+
+        with open(self.csvFilepath, 'w') as csvfile:
             filewriter = csv.writer(csvfile, delimiter=',', lineterminator='\n')
-            filewriter.writerow(['Grid Size', size])
+            filewriter.writerow(['Grid Size', self.gridSize])
             filewriter.writerow(['NULL', 'NodeType', 'GridX', 'GridY', 'Length', 'Width', 'Height', 'PosX', 'PosY', 'PosZ'])
             # NodeType 0 = center
             # next 8 nodes are it's neighbours, NULL if they dont exist
@@ -46,70 +295,94 @@ class NavMeshGenerator():
             # -1 0
             # -1 -1
             # 0 -1
-            #repeat for all points in grid (size x size)
-            directions = [[1, -1], [1, 0], [1, 1], [0, 1],
-                         [-1, 1], [-1, 0], [-1, -1], [0, -1]]
-
-            grid = []
-            for x in range(int(size/xstep)):
-                for y in range(int(size/ystep)):
-                    grid.append(str(x)+'x'+str(y))
-            
-            nullRow = '1,1,0,0,0,0,0,0,0,0'.split(',')      
-     
-            rowDict = {}
-            for gridElement in grid:
-                x, y = gridElement_to_x_y(gridElement)
-                newRow = ['0', '0', x, y, xstep, ystep, 0, x*xstep + bottomLeftCorner.x, y*ystep + bottomLeftCorner.y, 0 + bottomLeftCorner.z]
-                rowDict[gridElement] = newRow
-            
-            if self.bitMask.getNumOnBits() > 0:
-                if self.scene is None:
-                    self.scene = base.world
-
-                removeList = []
-                for key, value in rowDict.items():
-                    collisions = 0
-                    start = Vec3(value[-3], value[-2], value[-1])
-                    for dir in directions:
-                        end = Vec3((xstep*dir[0]) + start.x, (ystep*dir[1]) + start.y, start.z)
-
-                        result = self.scene.rayTestClosest(start, end)
-
-                        if result.hasHit():
-                            collisions += 1
-
-                    if collisions == 0:
-                        removeList.append(key)
-
-                for item in removeList:
-                    rowDict.pop(item)
-            
-            for gridElement, row in rowDict.items():
-                x, y = gridElement_to_x_y(gridElement)
-                neighbours = []
-                for direction in directions:
-                    neighbourx = x - direction[0]
-                    neighboury = y - direction[1]
-                    neighbour = str(neighbourx)+'x'+str(neighboury)
-                    if neighbour in grid:
-                        neighbours.append(neighbour)
-                    else:
-                        neighbours.append('nope')
-                filewriter.writerow(rowDict[gridElement])
-                for n in neighbours:
-                    if n in rowDict.keys():
-                        newRow = rowDict[n].copy()
-                        newRow[1] = 1
-                    else:
-                        newRow = nullRow.copy()
-                    filewriter.writerow(newRow)
-    
- 
-
-    
-
-    
-    
-    
-    
\ No newline at end of file
+            #repeat for every wall cell in the grid
+            nullRow = '1,1,0,0,0,0,0,0,0,0'.split(',')
+
+            for x in range(width):
+                for y in range(height):
+                    if not walls[x*height + y]:
+                        continue
+                    filewriter.writerow(row(x, y))
+                    for direction in DIRECTIONS:
+                        neighbourx = x - direction[0]
+                        neighboury = y - direction[1]
+                        if 0 <= neighbourx < width and 0 <= neighboury < height and walls[neighbourx*height + neighboury]:
+                            newRow = row(neighbourx, neighboury)
+                            newRow[1] = 1
+                        else:
+                            newRow = nullRow
+                        filewriter.writerow(newRow)
+
+
+if __name__ == '__main__':
+    # e.g. python navmeshgenerator.py --grid-size 100 --step 1 --origin -50 -50 3 --workers 4
+    parser = argparse.ArgumentParser(description='Build the nav map from the collision geometry without opening a '
+                                                 'window, the same way GENERATE_NAVMESH does in main.py.')
+    parser.add_argument('--output', default=os.path.join('NavMeshes', 'defaultnavmesh.nav'),
+                        help='binary nav map to write')
+    parser.add_argument('--grid-size', type=float, default=100, help='world size of the (square) map')
+    parser.add_argument('--step', type=float, default=1, help='world size of one cell')
+    parser.add_argument('--origin', type=float, nargs=3, default=(-50, -50, 3), metavar=('X', 'Y', 'Z'),
+                        help='world position of cell 0, 0')
+    parser.add_argument('--bitmask', type=lambda value: int(value, 0), default=0xffffffff,
+                        help='collision bit mask, 0 skips probing and marks every cell a wall')
+    parser.add_argument('--workers', type=int, default=0, help='probe in this many processes')
+    parser.add_argument('--tile-size', type=int, default=32, help='cells per side of a tile handed to a worker')
+    parser.add_argument('--csv', action='store_true', help='also write the legacy CSV next to the map')
+    parser.add_argument('--region', type=float, nargs=4, metavar=('X0', 'Y0', 'X1', 'Y1'),
+                        help='only probe around this world space box and patch it into the existing map')
+    parser.add_argument('--rasterize', action='store_true',
+                        help='rasterize the wall and pillar triangles instead of raycasting them')
+    parser.add_argument('--height-band', type=float, nargs=2, default=(1, 4), metavar=('LOW', 'HIGH'),
+                        help='world z range an agent occupies, only geometry inside it is rasterized')
+    parser.add_argument('--compare', metavar='MAP',
+                        help='report how many cells of the new map differ from MAP, e.g. the shipped one')
+    args = parser.parse_args()
+
+    # nothing here needs a window or sound
+    loadPrcFileData('', 'window-type none\naudio-library-name null')
+
+    generator = NavMeshGenerator()
+    generator.dirname, generator.basename = os.path.split(args.output)
+    generator.dirname = generator.dirname or '.'
+    generator.legacyCsv = args.csv
+    generator.gridSize = args.grid_size
+    generator.xstep = generator.ystep = args.step
+    generator.bottomLeftCorner = LVecBase3f(*args.origin)
+    generator.bitMask = BitMask32(args.bitmask)
+    generator.workers = args.workers
+    generator.tileSize = args.tile_size
+    generator.rasterize = args.rasterize
+    generator.heightBand = tuple(args.height_band)
+
+    start = time.perf_counter()
+    if generator.rasterize:
+        from navrasterizer import mapTriangles
+        generator.triangles = mapTriangles()
+    elif generator.workers <= 0:
+        generator.scene = buildCollisionWorld()
+    loaded = time.perf_counter()
+    if args.region:
+        patch = generator.regenerate(args.region[:2], args.region[2:])
+        done = time.perf_counter()
+        if patch is None:
+            parser.exit(1, 'The region is off the map\n')
+        x, y, columns = patch
+        print('Patched cells %d, %d to %d, %d of %s' % (x, y, x + len(columns) - 1, y + len(columns[0]) - 1,
+                                                         generator.filepath))
+    else:
+        walls = generator.generate()
+        done = time.perf_counter()
+        width = int(generator.gridSize / generator.xstep)
+        height = int(generator.gridSize / generator.ystep)
+        print('Wrote %dx%d map (%d walls) to %s' % (width, height, sum(walls), generator.filepath))
+
+        if args.compare:
+            other = readNavMap(args.compare)
+            if other is None or (other.width, other.height) != (width, height):
+                parser.exit(1, "Can't compare with %s, it isn't a %dx%d map\n" % (args.compare, width, height))
+            differ = [(x, y) for x in range(width) for y in range(height)
+                      if walls[x*height + y] != (other.grid[(x + 1) * other.stride + y + 1] == OBSTACLE)]
+            print('%d of %d cells differ from %s' % (len(differ), width * height, args.compare))
+    print('%s %8.3f s' % ('load geometry  ' if generator.rasterize else 'collision world', loaded - start))
+    print('probe and write %8.3f s' % (done - loaded))
@@ -0,0 +1,155 @@
+import math
+import threading
+from array import array
+from weakref import WeakSet
+
+from pathfinder import OBSTACLE
+
+
+class NavOverlay:
+    """
+    Moving obstacles stamped on top of a static NavMap, e.g. a pile of stuck enemies. The NavMap itself is never
+    touched: the overlay keeps its own combined copy of the grid (and search template) that pathfinders using it
+    search instead. Every stamp belongs to an owner, restamping an owner only rewrites the cells that changed,
+    and the changed cells are handed to every pathfinder using the overlay so they can drop just the cached
+    paths and flow fields that cross them.
+
+    Agents may stand inside a stamp (usually their own), searches can start and end there but never pass through.
+    """
+
+    def __init__(self, navmap):
+        self.navmap = navmap
+        self.width = navmap.width
+        self.height = navmap.height
+        self.stride = navmap.stride
+
+        # the static map with every stamp on it
+        self.grid = array('b', navmap.grid)
+        self.template = array('i', navmap.template)
+
+        self.counts = {}  # flat index -> number of stamps covering it
+        self.stamps = {}  # owner -> flat indices it covers
+        self.pathfinders = WeakSet()
+
+        # pathfinders join from PathService worker threads while stamps are made on the game's thread
+        self.lock = threading.Lock()
+
+    def useMap(self, navmap, changed=None):
+        """
+        Move the overlay and its stamps onto navmap, a patched copy of its map (see NavMap.patched) that changed
+        the cells with flat indices changed. With changed None navmap is any new version of the map (see
+        NavMapRegistry.reload), the stamps are laid again on its free cells, or dropped if its size changed.
+        """
+        if changed is None:
+            self._rebuild(navmap)
+            return
+
+        self.navmap = navmap
+        grid = self.grid
+        template = self.template
+        for index in changed:
+            if index not in self.counts:
+                grid[index] = navmap.grid[index]
+                template[index] = navmap.template[index]
+        self._notify(changed)
+
+    def addPathfinder(self, pathfinder):
+        with self.lock:
+            self.pathfinders.add(pathfinder)
+
+    def removePathfinder(self, pathfinder):
+        with self.lock:
+            self.pathfinders.discard(pathfinder)
+
+    def _notify(self, changed):
+        """ Hand the changed cells to every pathfinder using the overlay """
+        with self.lock:
+            pathfinders = list(self.pathfinders)
+        for pathfinder in pathfinders:
+            pathfinder.markDirty(changed)
+
+    def _rebuild(self, navmap):
+        if (navmap.width, navmap.height) != (self.width, self.height):
+            self.stamps = {}
+        self.navmap = navmap
+        self.width = navmap.width
+        self.height = navmap.height
+        self.stride = navmap.stride
+
+        # fresh arrays, pathfinders still on the old map keep searching the old ones until they're moved
+        self.grid = array('b', navmap.grid)
+        self.template = array('i', navmap.template)
+        self.counts = {}
+        stamps, self.stamps = self.stamps, {}
+        for owner, cells in stamps.items():
+            self.stamps[owner] = frozenset(index for index in cells if navmap.grid[index] != OBSTACLE)
+            self._update((), self.stamps[owner])
+
+    def _cells(self, position, radius):
+        """ Flat indices of the statically free cells within radius (a square) of position, in map coordinates """
+        x0 = max(math.floor(position[0] - radius), 0)
+        x1 = min(math.floor(position[0] + radius), self.width - 1)
+        y0 = max(math.floor(position[1] - radius), 0)
+        y1 = min(math.floor(position[1] + radius), self.height - 1)
+        grid = self.navmap.grid
+        stride = self.stride
+        return frozenset(index for x in range(x0, x1 + 1) for index in range((x + 1) * stride + y0 + 1,
+                                                                             (x + 1) * stride + y1 + 2)
+                         if grid[index] != OBSTACLE)
+
+    def stamp(self, owner, position, radius=0):
+        """
+        Block the cells around position for owner, moving owner's previous stamp. Cheap to call every frame,
+        nothing changes while owner stays on the same cells.
+
+        Parameters
+        owner - any hashable object the stamp belongs to
+        position - x, y in map coordinates
+        radius - half the width of the blocked square in cells, 0 blocks just the cell position is in
+        """
+        cells = self._cells(position, radius)
+        old = self.stamps.get(owner, frozenset())
+        if cells == old:
+            return
+        self.stamps[owner] = cells
+        self._update(old - cells, cells - old)
+
+    def clear(self, owner):
+        """ Remove owner's stamp, if it has one """
+        old = self.stamps.pop(owner, None)
+        if old:
+            self._update(old, ())
+
+    def clearAll(self):
+        for owner in list(self.stamps):
+            self.clear(owner)
+
+    def isBlocked(self, x, y):
+        """ Is map cell x, y blocked, either by the static map or a stamp """
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.grid[(x + 1) * self.stride + y + 1] == OBSTACLE
+        return True
+
+    def _update(self, removed, added):
+        grid = self.grid
+        template = self.template
+        static = self.navmap.grid
+        counts = self.counts
+        changed = []
+
+        for index in removed:
+            counts[index] -= 1
+            if counts[index] == 0:
+                del counts[index]
+                grid[index] = static[index]
+                template[index] = static[index]
+                changed.append(index)
+        for index in added:
+            counts[index] = counts.get(index, 0) + 1
+            if counts[index] == 1:
+                grid[index] = OBSTACLE
+                template[index] = OBSTACLE
+                changed.append(index)
+
+        if changed:
+            self._notify(changed)
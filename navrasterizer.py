@@ -0,0 +1,135 @@
+# Builds the nav map straight from the map geometry: every wall and pillar triangle is clipped to the height band
+# an agent's body occupies and rasterized into the grid, so no raycasts are needed and any cell size works.
+# NavMeshGenerator uses it instead of its probes when rasterize is set (--rasterize on the command line).
+import math
+
+from panda3d.core import GeomVertexReader, Vec3
+
+from navmeshgenerator import loadMapModel, WALL_MODEL, PILLAR_MODEL, PILLAR_POSITIONS
+from pathfinder import NavMap, FREE, WALL
+
+
+def modelTriangles(model, offset=Vec3(0, 0, 0)):
+    """
+    Every triangle of model in world space, moved by offset.
+
+    Return
+    a list of 3-tuples of x, y, z points
+    """
+    triangles = []
+    for geomNode in model.findAllMatches('**/+GeomNode'):
+        mat = geomNode.getNetTransform().getMat()
+        node = geomNode.node()
+        for i in range(node.getNumGeoms()):
+            geom = node.getGeom(i).decompose()
+            reader = GeomVertexReader(geom.getVertexData(), 'vertex')
+            points = []
+            while not reader.isAtEnd():
+                point = mat.xformPoint(reader.getData3()) + offset
+                points.append((point.x, point.y, point.z))
+
+            for p in range(geom.getNumPrimitives()):
+                primitive = geom.getPrimitive(p)
+                for t in range(primitive.getNumPrimitives()):
+                    start = primitive.getPrimitiveStart(t)
+                    end = primitive.getPrimitiveEnd(t)
+                    triangles.append(tuple(points[primitive.getVertex(k)] for k in range(start, end)))
+    return triangles
+
+
+def mapTriangles():
+    """ The triangles of the walls and every pillar, placed the way main.py places them """
+    triangles = modelTriangles(loadMapModel(WALL_MODEL))
+    pillar = loadMapModel(PILLAR_MODEL)
+    for position in PILLAR_POSITIONS:
+        triangles += modelTriangles(pillar, position)
+    return triangles
+
+
+def _clip(polygon, axis, low, high):
+    """ Clip a convex polygon (a list of points) to low <= point[axis] <= high """
+    for keep, bound in ((lambda v: v >= low, low), (lambda v: v <= high, high)):
+        if not polygon:
+            break
+        clipped = []
+        for a, b in zip(polygon, polygon[1:] + polygon[:1]):
+            if keep(a[axis]):
+                clipped.append(a)
+            if keep(a[axis]) != keep(b[axis]):
+                t = (bound - a[axis]) / (b[axis] - a[axis])
+                clipped.append(tuple(a[i] + (b[i] - a[i]) * t for i in range(len(a))))
+        polygon = clipped
+    return polygon
+
+
+def rasterize(triangles, width, height, origin, cellSize, heightBand, reach=None, region=None):
+    """
+    Mark every cell that any triangle touches inside the height band as a wall.
+
+    Cells follow NavMeshGenerator's convention: cell x, y stands for the world point origin + (x, y) * cellSize,
+    where the game puts its waypoints and the generator casts its probes from. Its rays reach one cell out in
+    every direction, so by default a cell is a wall when geometry comes within a cell of its point.
+
+    Parameters
+    triangles - a list of 3-tuples of x, y, z points in world space
+    width, height - the size of the grid in cells
+    origin - the world x, y of cell 0, 0
+    cellSize - world size of one cell
+    heightBand - the lowest and highest world z an agent's body occupies
+    reach - how far (in world units, on either axis) from a cell's point geometry makes it a wall, cellSize if None
+    region - only rasterize the cells x0 <= x < x1, y0 <= y < y1 (x0, x1, y0, y1), every cell if None
+
+    Return
+    the grid as a list of lists, nav_map[x][y]
+    """
+    nav_map = [[FREE] * height for _ in range(width)]
+    ox, oy = origin[0], origin[1]
+    reach = cellSize if reach is None else reach
+    x0, x1, y0, y1 = region if region is not None else (0, width, 0, height)
+
+    for triangle in triangles:
+        # the part of the triangle inside the band, flattened onto the ground
+        polygon = _clip(list(triangle), 2, heightBand[0], heightBand[1])
+        if not polygon:
+            continue
+        polygon = [(x, y) for x, y, _ in polygon]
+
+        xs = [x for x, _ in polygon]
+        first = max(math.ceil((min(xs) - reach - ox) / cellSize), x0)
+        last = min(math.floor((max(xs) + reach - ox) / cellSize), x1 - 1)
+
+        # the slice of a convex polygon in one column is convex, so its y extent is exactly the cells it covers
+        for column in range(first, last + 1):
+            middle = ox + column * cellSize
+            strip = _clip(polygon, 0, middle - reach, middle + reach)
+            if not strip:
+                continue
+            ys = [y for _, y in strip]
+            bottom = max(math.ceil((min(ys) - reach - oy) / cellSize), y0)
+            top = min(math.floor((max(ys) + reach - oy) / cellSize), y1 - 1)
+            cells = nav_map[column]
+            for row in range(bottom, top + 1):
+                cells[row] = WALL
+    return nav_map
+
+
+def rasterizeMap(gridSize=100, cellSize=1.0, origin=(-50, -50, 3), heightBand=(1, 4), triangles=None, reach=None):
+    """
+    Build a nav map of the arena from its geometry, NavMeshGenerator does the same with rasterize set.
+
+    Parameters
+    gridSize - world size of the (square) map
+    cellSize - world size of one cell, anything from the old 1 unit step down to a fraction of it
+    origin - world position of cell 0, 0 (the z is only stored with the map)
+    heightBand - the lowest and highest world z an agent's body occupies, geometry outside it is ignored
+    triangles - the geometry to rasterize, the walls and pillars of the map if not given
+    reach - see rasterize
+
+    Return
+    a NavMap
+    """
+    if triangles is None:
+        triangles = mapTriangles()
+    cells = int(gridSize / cellSize)
+    nav_map = rasterize(triangles, cells, cells, origin, cellSize, heightBand, reach)
+    return NavMap(nav_map, origin=tuple(origin), cell_size=cellSize)
@@ -0,0 +1,281 @@
+# Headless pathfinding benchmark: times Pathfinder.getPath over the shipped map and generated maps, saves the
+# results as a JSON baseline and flags regressions against an earlier one. Nothing here opens a window.
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+from pathfinder import Pathfinder, NavMap, JPS, FLOW, HPA, JPS_PLUS, VISIBILITY, FREE, WALL, OBSTACLE, FLOW_DIRECTIONS, \
+    readNavMap
+from resourcepath import resource_path
+
+SHIPPED_MAP = 'NavMeshes/defaultnavmesh.json'
+KINDS = ('open', 'maze', 'pillars')
+SIZES = (100, 250, 500, 1000, 2000)
+
+# a result is a regression when it is this much worse than the baseline
+THRESHOLD = 0.1
+
+
+def openField(size, rng):
+    """ No walls at all, the search is one long straight run """
+    return [[FREE] * size for _ in range(size)]
+
+
+def maze(size, rng):
+    """ A perfect maze of one cell wide corridors, cut with an iterative depth first search """
+    nav_map = [[WALL] * size for _ in range(size)]
+    cells = (size - 1) // 2
+    nav_map[1][1] = FREE
+    stack = [(0, 0)]
+    visited = {(0, 0)}
+    while stack:
+        x, y = stack[-1]
+        options = [(x + dx, y + dy) for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1))
+                   if 0 <= x + dx < cells and 0 <= y + dy < cells and (x + dx, y + dy) not in visited]
+        if not options:
+            stack.pop()
+            continue
+        nx, ny = rng.choice(options)
+        visited.add((nx, ny))
+        nav_map[x + nx + 1][y + ny + 1] = FREE
+        nav_map[2 * nx + 1][2 * ny + 1] = FREE
+        stack.append((nx, ny))
+    return nav_map
+
+
+def pillars(size, rng):
+    """
+    The arena from main.py repeated over the whole map: solid 7 x 7 pillars at the corners and the center of
+    every 52 x 56 tile (the 26, 28.33 pillar offsets), inside a 3 cell thick outer wall.
+    """
+    nav_map = [[FREE] * size for _ in range(size)]
+    for x in range(size):
+        for y in range(size):
+            if min(x, y, size - 1 - x, size - 1 - y) < 3:
+                nav_map[x][y] = WALL
+
+    def pillar(cx, cy):
+        for x in range(cx - 3, cx + 4):
+            for y in range(cy - 3, cy + 4):
+                if 0 <= x < size and 0 <= y < size:
+                    nav_map[x][y] = WALL
+
+    for tx in range(0, size, 52):
+        for ty in range(0, size, 56):
+            pillar(tx + 13, ty + 14)
+            pillar(tx + 39, ty + 42)
+    return nav_map
+
+
+GENERATORS = {'open': openField, 'maze': maze, 'pillars': pillars}
+
+
+def _largestComponent(navmap):
+    """ Flat indices of the biggest connected free area, the shipped map has unreachable cells outside its walls """
+    grid = navmap.grid
+    stride = navmap.stride
+    steps = [dx * stride + dy for dx, dy in FLOW_DIRECTIONS]
+    seen = set()
+    best = []
+    for x in range(navmap.width):
+        for y in range(navmap.height):
+            index = (x + 1) * stride + y + 1
+            if index in seen or grid[index] == OBSTACLE:
+                continue
+            seen.add(index)
+            component = [index]
+            for cur in component:
+                for step in steps:
+                    n = cur + step
+                    if n not in seen and grid[n] != OBSTACLE:
+                        seen.add(n)
+                        component.append(n)
+            if len(component) > len(best):
+                best = component
+    return best
+
+
+def queries(navmap, count, rng, connected=True):
+    """
+    count random (start, goal) pairs of free cells, all connected to each other when connected is True,
+    otherwise only from the largest free area.
+    """
+    if connected:
+        def pick():
+            while True:
+                x, y = rng.randrange(navmap.width), rng.randrange(navmap.height)
+                if navmap.grid[(x + 1) * navmap.stride + y + 1] != OBSTACLE:
+                    return x, y
+    else:
+        component = _largestComponent(navmap)
+
+        def pick():
+            x, y = divmod(rng.choice(component), navmap.stride)
+            return x - 1, y - 1
+
+    return [(pick(), pick()) for _ in range(count)]
+
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def run(name, nav_map, mode=JPS, count=50, seed=1, connected=True, memory_queries=5):
+    """
+    Time count getPath queries over nav_map (a list of lists or a map file).
+
+    Return
+    a dict of the scenario's results, latencies in milliseconds and memory in bytes
+    """
+    rng = random.Random(seed)
+    navmap = readNavMap(nav_map)
+    if navmap is None:
+        raise ValueError("Can't load map " + str(name))
+    # an unnamed copy, so no precomputed data is loaded from or saved next to a map file and every run sets up
+    # from scratch
+    navmap = NavMap.fromGrid(navmap.grid, navmap.width, navmap.height)
+    pairs = queries(navmap, count, rng, connected)
+
+    pathfinder = Pathfinder(mode=mode)
+    start = time.perf_counter()
+    pathfinder.useMap(navmap)
+    setup = time.perf_counter() - start
+
+    # warm up on a few of the queries first, then start the counters over
+    for start, goal in pairs[:memory_queries]:
+        pathfinder.getPath(start, goal)
+    pathfinder.expansions = 0
+
+    latencies = []
+    found = 0
+    for start, goal in pairs:
+        begin = time.perf_counter()
+        path = pathfinder.getPath(start, goal)
+        latencies.append(time.perf_counter() - begin)
+        if path is not None:
+            found += 1
+    total = sum(latencies)
+
+    # every pair is connected, so a search that fails is a bug and its time says nothing about throughput
+    complete = found == count
+
+    # peak memory of a fresh pathfinder setting up on the map and answering a few queries, measured on its own
+    # as tracing slows everything down
+    tracemalloc.start()
+    traced = Pathfinder(mode=mode)
+    traced.useMap(NavMap.fromGrid(navmap.grid, navmap.width, navmap.height))
+    for start, goal in pairs[:memory_queries]:
+        traced.getPath(start, goal)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'map': name,
+        'mode': mode,
+        'width': navmap.width,
+        'height': navmap.height,
+        'queries': count,
+        'found': found,
+        'complete': complete,
+        'setup_ms': setup * 1000,
+        'searches_per_sec': (count / total if total else 0) if complete else None,
+        'p50_ms': _percentile(latencies, 50) * 1000 if complete else None,
+        'p99_ms': _percentile(latencies, 99) * 1000 if complete else None,
+        'nodes_expanded': pathfinder.expansions / count if mode == JPS else None,
+        'peak_memory': peak,
+    }
+
+
+def scenarios(kinds=KINDS, sizes=SIZES, shipped=True, seed=1):
+    """ (name, nav map, connected) for the shipped map and every kind of generated map at every size """
+    if shipped:
+        yield 'shipped', resource_path(SHIPPED_MAP), False
+    for kind in kinds:
+        for size in sizes:
+            yield '%s-%d' % (kind, size), GENERATORS[kind](size, random.Random(seed)), True
+
+
+def benchmark(kinds=KINDS, sizes=SIZES, mode=JPS, count=50, seed=1, shipped=True, verbose=True):
+    results = {}
+    for name, nav_map, connected in scenarios(kinds, sizes, shipped, seed):
+        result = run(name, nav_map, mode, count, seed, connected)
+        results[name] = result
+        if verbose:
+            print(describe(result))
+    return {'version': 1, 'mode': mode, 'python': sys.version.split()[0], 'results': results}
+
+
+def describe(result):
+    def number(value, width):
+        return '%*.*f' % (width, 3 if width == 8 else 1, value) if value is not None else ' ' * (width - 1) + '-'
+
+    return '%-14s %s/s  p50 %s ms  p99 %s ms  nodes %s  peak %8.1f KiB  found %d/%d%s' % (
+        result['map'], number(result['searches_per_sec'], 9), number(result['p50_ms'], 8),
+        number(result['p99_ms'], 8), number(result['nodes_expanded'], 9), result['peak_memory'] / 1024,
+        result['found'], result['queries'], '' if result.get('complete', True) else '  INCOMPLETE')
+
+
+def compare(baseline, current, threshold=THRESHOLD):
+    """
+    Compare two benchmark() results. Throughput, latency and memory may move by threshold (a fraction) before
+    they count, nodes expanded is deterministic so any increase counts. Throughput and latency are only compared
+    between complete runs, where every search found its path.
+
+    Return
+    a list of regression descriptions, empty if there are none
+    """
+    regressions = []
+    for name, new in current['results'].items():
+        old = baseline['results'].get(name)
+        if old is None or old['mode'] != new['mode'] or old['queries'] != new['queries']:
+            continue
+        timed = old['searches_per_sec'] is not None and new['searches_per_sec'] is not None
+        if timed and new['searches_per_sec'] < old['searches_per_sec'] * (1 - threshold):
+            regressions.append('%s: %.1f searches/s, was %.1f' % (name, new['searches_per_sec'],
+                                                                  old['searches_per_sec']))
+        for key in ('p50_ms', 'p99_ms'):
+            if timed and new[key] > old[key] * (1 + threshold):
+                regressions.append('%s: %s %.3f, was %.3f' % (name, key, new[key], old[key]))
+        if new['peak_memory'] > old['peak_memory'] * (1 + threshold):
+            regressions.append('%s: peak memory %d bytes, was %d' % (name, new['peak_memory'], old['peak_memory']))
+        if old['nodes_expanded'] is not None and new['nodes_expanded'] is not None and \
+                new['nodes_expanded'] > old['nodes_expanded']:
+            regressions.append('%s: %.1f nodes expanded, was %.1f' % (name, new['nodes_expanded'],
+                                                                     old['nodes_expanded']))
+        if new['found'] != old['found']:
+            regressions.append('%s: found %d paths, was %d' % (name, new['found'], old['found']))
+    return regressions
+
+
+if __name__ == '__main__':
+    # e.g. python pathbenchmark.py --sizes 100 500 --save baseline.json, then later --compare baseline.json
+    parser = argparse.ArgumentParser(description='Benchmark Pathfinder.getPath without opening a window.')
+    parser.add_argument('--mode', default=JPS, choices=(JPS, FLOW, HPA, JPS_PLUS, VISIBILITY))
+    parser.add_argument('--kinds', nargs='+', default=list(KINDS), choices=KINDS)
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(SIZES))
+    parser.add_argument('--queries', type=int, default=50, help='searches per map')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-shipped', action='store_true', help='skip the shipped map')
+    parser.add_argument('--save', metavar='JSON', help='write the results as a baseline')
+    parser.add_argument('--compare', metavar='JSON', help='flag regressions against a saved baseline')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='allowed slowdown, as a fraction')
+    args = parser.parse_args()
+
+    results = benchmark(args.kinds, args.sizes, args.mode, args.queries, args.seed, not args.no_shipped)
+
+    if args.save:
+        with open(args.save, 'w') as outfile:
+            json.dump(results, outfile, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+        print('No regressions')
@@ -1,6 +1,11 @@
 import heapq
 import itertools
 import json
+import math
+import os
+import threading
+from array import array
+from collections import OrderedDict
 
 from direct.stdpy.file import exists, open
 from panda3d.core import PNMImage
@@ -12,6 +17,19 @@ UNINITIALIZED = -1
 WALL = OBSTACLE
 FREE = UNINITIALIZED
 
+# search modes understood by Pathfinder.getPath
+JPS = 'jps'
+FLOW = 'flow'
+HPA = 'hpa'
+JPS_PLUS = 'jps+'
+VISIBILITY = 'visibility'
+
+# key of the clearance map in NavMap.derived
+CLEARANCE = 'clearance'
+
+# neighbour order used when growing the flow field, cardinals first so straight moves win ties
+FLOW_DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1))
+
 
 class FoundPath(Exception):
     """ Raise this when you found a path. it's not really an error,
@@ -46,203 +64,1186 @@ class FastPriorityQueue:
         return len(self.pq) == 0
 
 
-def _getPath(sources, start_x, start_y, end_x, end_y):
+def _getPath(sources, stride, start, end):
     """
     Reconstruct the path from the source information as given by jps(...).
 
     Parameters
-    sources          - a 2d array of the predecessor to each node
-    start_x, start_y - the x, y coordinates of the starting position
-    end_x, end_y     - the x, y coordinates of the destination
+    sources    - a flat array of the predecessor index to each node
+    stride     - the row length of the padded grid the indices refer to
+    start, end - the flat indices of the starting position and the destination
 
     Return
     a list of jump points as 2-tuples (coordinates) starting from the start node and finishing at the end node.
     """
     result = []
-    cur_x, cur_y = end_x, end_y
+    cur = end
 
-    while cur_x != start_x or cur_y != start_y:
-        result.append((cur_x, cur_y))
-        cur_x, cur_y = sources[cur_x][cur_y]
+    while cur != start:
+        result.append((cur // stride - 1, cur % stride - 1))
+        cur = sources[cur]
     result.reverse()
-    return [(start_x, start_y)] + result
+    return [(start // stride - 1, start % stride - 1)] + result
 
 
-class Pathfinder:
-    def __init__(self):
+def _compressPath(cells, stride):
+    """
+    Turn a cell by cell route into the same shape as a JPS path.
+
+    Parameters
+    cells  - flat indices of every cell on the route, from start to end
+    stride - the row length of the padded grid the indices refer to
+
+    Return
+    a list of 2-tuples (coordinates) holding the start, every cell where the direction changes, and the end.
+    """
+    result = [(cells[0] // stride - 1, cells[0] % stride - 1)]
+    for prev, cur, nxt in zip(cells, cells[1:], cells[2:]):
+        if cur - prev != nxt - cur:
+            result.append((cur // stride - 1, cur % stride - 1))
+    if len(cells) > 1:
+        result.append((cells[-1] // stride - 1, cells[-1] % stride - 1))
+    return result
+
+
+def _lineCells(x0, y0, x1, y1, stride):
+    """
+    Flat indices of every cell the straight line between the centers of cells x0, y0 and x1, y1 passes through,
+    both ends included. Where the line goes exactly through a corner, both cells beside it are included too.
+    """
+    dx = abs(x1 - x0)
+    dy = abs(y1 - y0)
+    step_x = stride if x1 > x0 else -stride
+    step_y = 1 if y1 > y0 else -1
+    index = (x0 + 1) * stride + y0 + 1
+    yield index
+
+    # error is positive while the next x border comes before the next y border
+    error = dx - dy
+    remaining = dx + dy
+    while remaining > 0:
+        if error > 0:
+            index += step_x
+            error -= 2 * dy
+            remaining -= 1
+        elif error < 0:
+            index += step_y
+            error += 2 * dx
+            remaining -= 1
+        else:
+            yield index + step_x
+            yield index + step_y
+            index += step_x + step_y
+            error += 2 * (dx - dy)
+            remaining -= 2
+        yield index
+
+
+def _pathCells(path, stride):
+    """ Flat indices of every cell along a path of waypoints joined by straight lines, at any angle """
+    for (x0, y0), (x1, y1) in zip(path, path[1:]):
+        dx = (x1 > x0) - (x1 < x0)
+        dy = (y1 > y0) - (y1 < y0)
+        if x0 != x1 and y0 != y1 and abs(x1 - x0) != abs(y1 - y0):
+            yield from list(_lineCells(x0, y0, x1, y1, stride))[:-1]
+            continue
+        index = (x0 + 1) * stride + y0 + 1
+        for _ in range(max(abs(x1 - x0), abs(y1 - y0))):
+            yield index
+            index += dx * stride + dy
+    if path:
+        yield (path[-1][0] + 1) * stride + path[-1][1] + 1
+
+
+def _chamfer(grid, clearance, stride, x0, x1, y0, y1):
+    """
+    Fill clearance with every cell's distance (diagonals included) to the nearest wall, for the padded cells
+    x0 <= x < x1, y0 <= y < y1. The cells around that window are taken as they are, so a window that
+    reaches far enough past a change gives the same result as doing the whole map.
+    """
+    big = len(grid)
+    for x in range(x0, x1):
+        for index in range(x * stride + y0, x * stride + y1):
+            clearance[index] = 0 if grid[index] == OBSTACLE else big
+
+    # two passes, each cell takes the smallest of its already visited neighbours plus one
+    for xs, ys, offsets in ((range(x0, x1), range(y0, y1), (-stride - 1, -stride, -stride + 1, -1)),
+                            (range(x1 - 1, x0 - 1, -1), range(y1 - 1, y0 - 1, -1), (stride + 1, stride, stride - 1, 1))):
+        for x in xs:
+            for index in range(x * stride + ys.start, x * stride + ys.stop, ys.step):
+                value = clearance[index]
+                if value:
+                    for offset in offsets:
+                        if clearance[index + offset] + 1 < value:
+                            value = clearance[index + offset] + 1
+                    clearance[index] = value
+
+
+class NavMap:
+    """
+    A nav map packed into a flat typed array, padded with a one cell wall border so the explore loops never
+    have to bounds check. A NavMap is never modified once built, so any number of Pathfinders can search it
+    at once, each with their own scratch buffers.
+    """
+
+    def __init__(self, nav_map, name=None, origin=None, cell_size=1.0):
+        width = len(nav_map)
+        height = len(nav_map[0]) if width else 0
+        stride = height + 2
+
+        grid = array('b', [OBSTACLE]) * ((width + 2) * stride)
+        for x, column in enumerate(nav_map):
+            offset = (x + 1) * stride + 1
+            grid[offset:offset + height] = array('b', column)
+        self._setGrid(grid, width, height, name, origin, cell_size)
+
+    @classmethod
+    def fromGrid(cls, grid, width, height, name=None, origin=None, cell_size=1.0):
+        """ Wrap an already padded grid, either an array('b') or a read-only buffer such as a memory-mapped file """
+        navmap = cls.__new__(cls)
+        navmap._setGrid(grid, width, height, name, origin, cell_size)
+        return navmap
+
+    def _setGrid(self, grid, width, height, name, origin, cell_size):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.stride = height + 2
+        self.grid = grid
+
+        # where cell 0, 0 sits in the world and how big a cell is, when known
+        self.origin = origin
+        self.cell_size = cell_size
+
+        # what a search field looks like before the search starts
+        self.template = array('i', grid)
+
+        # precomputed search data (HPA graphs, JPS+ tables) shared by every pathfinder on this map
+        self.derived = {}
+
+    def __getstate__(self):
+        # derived data is rebuilt or reloaded on the other side, and a memory-mapped grid is sent as a copy
+        state = dict(self.__dict__)
+        state['derived'] = {}
+        state.pop('buffer', None)
+        if not isinstance(self.grid, array):
+            state['grid'] = array('b')
+            state['grid'].frombytes(self.grid.tobytes())
+        return state
+
+    def patched(self, x, y, columns):
+        """
+        A copy of this map with a block of cells written over it, e.g. a region NavMeshGenerator probed again.
+        Precomputed data is carried over to the copy and only rebuilt around the block, this map is left as it is.
+
+        Parameters
+        x, y - the map cell the block starts at
+        columns - the block's columns, bytes-like runs of signed cells (FREE or WALL) from y upward
+
+        Return
+        the new NavMap and a set of the flat indices whose cells or clearance may have changed
+        """
+        grid = array('b')
+        grid.frombytes(bytes(self.grid))
+        template = array('i', self.template)
+        stride = self.stride
+
+        columns = list(columns)
+        x1 = min(x + len(columns), self.width)
+        y1 = min(y + max((len(column) for column in columns), default=0), self.height)
+        changed = set()
+        for cx, column in zip(range(x, x1), columns):
+            cells = array('b')
+            cells.frombytes(bytes(column)[:y1 - y])
+            offset = (cx + 1) * stride + y + 1
+            grid[offset:offset + len(cells)] = cells
+            template[offset:offset + len(cells)] = array('i', cells)
+            changed.update(range(offset, offset + len(cells)))
+
+        navmap = NavMap.fromGrid(grid, self.width, self.height, self.name, self.origin, self.cell_size)
+        navmap.template = template
+        if not changed:
+            navmap.derived = dict(self.derived)
+            return navmap, changed
+
+        if CLEARANCE in self.derived:
+            old = self.derived[CLEARANCE]
+            clearance = array('i', old)
+
+            # a cell further from the block than from its nearest wall keeps its clearance
+            reach = max(old) + 1
+            wx0, wx1 = max(x + 1 - reach, 1), min(x1 + 1 + reach, self.width + 1)
+            wy0, wy1 = max(y + 1 - reach, 1), min(y1 + 1 + reach, self.height + 1)
+            _chamfer(grid, clearance, stride, wx0, wx1, wy0, wy1)
+            window = [index for wx in range(wx0, wx1) for index in range(wx * stride + wy0, wx * stride + wy1)]
+            changed.update(index for index in window if clearance[index] != old[index])
+            navmap.derived[CLEARANCE] = clearance
+
+            for key, value in self.derived.items():
+                if isinstance(key, tuple) and key[0] == CLEARANCE:
+                    level = array('i', value)
+                    for index in window:
+                        level[index] = OBSTACLE if clearance[index] < key[1] else template[index]
+                    navmap.derived[key] = level
+
+        # after the clearance, which the visibility graphs read their templates from
+        region = (x, x1, y, y1)
+        for key, value in self.derived.items():
+            if hasattr(value, 'patched'):  # HPA graphs, JPS+ tables, visibility graphs
+                navmap.derived[key] = value.patched(navmap, region)
+
+        return navmap, changed
+
+    def cacheFile(self, extension):
+        """ Where precomputed data for this map is kept, next to the map file, None for maps built in memory """
+        if self.name is None:
+            return None
+        return os.path.splitext(self.name)[0] + extension
+
+
+def readNavMap(map_file):
+    """
+    Load a nav map from a list of lists, a binary nav map file, a JSON file or an image.
+
+    Return
+    a NavMap, None if it can't be loaded
+    """
+    # the map_file can be just a list
+    if type(map_file) is list:
+        return NavMap(map_file)
+    # it can also be a file
+    elif exists(map_file):
+        # ...a binary nav map?
+        from navmapfile import isBinaryNavMap, loadBinaryNavMap
+        if isBinaryNavMap(map_file):
+            return loadBinaryNavMap(map_file)
+        # ...a json file?
+        try:
+            with open(map_file) as f:
+                return NavMap(json.load(f), map_file)
+        except:
+            # ...an image?
+            try:
+                img = PNMImage(map_file)
+                max_x = img.getReadXSize()
+                max_y = img.getReadYSize()
+                temp_map = [[WALL for x in range(max_x)] for x in range(max_y)]
+                for x in range(max_x):
+                    for y in range(max_y):
+                        if img.getRedVal(x, y) < 0.5:
+                            temp_map[x][max_y - 1 - y] = FREE
+                return NavMap(temp_map, map_file)
+            except:
+                print("Can't load map!")
+    return None
 
-        # the map
-        self.nav_map = None
 
-    def _exploreDiagonal(self, startX, startY, directionX, directionY):
+class PathSearch:
+    """
+    One jump point search that can be advanced a few jump points at a time, so a long (or hopeless) search
+    can be spread over several frames. Pathfinder.getPath simply runs one to completion.
+    """
+
+    def __init__(self, navmap, start, end, field=None, sources=None, template=None, blocked=(), release=None):
+        """
+        Parameters
+        navmap - the NavMap to search
+        start, end - the x, y coordinates of the starting position and the destination
+        field, sources - scratch buffers to reuse, fresh ones are allocated if these aren't given
+        template - the field to start from, e.g. a NavOverlay's, navmap's own if not given. start and end
+                   only need to be free on navmap.
+        blocked - flat indices of extra cells to block on top of template
+        release - called with field and sources once the search is finished (or cancelled) and done with them
+        """
+        self.navmap = navmap
+        self.field = field
+        self.sources = sources
+        self.release = release
+        self.stride = navmap.stride
+        self.path = None
+        self.done = False
+        self.cancelled = False
+        self.expansions = 0
+
+        self.start_x = int(start[0])
+        self.start_y = int(start[1])
+        self.end_x = int(end[0])
+        self.end_y = int(end[1])
+        self.start = self._index(self.start_x, self.start_y)
+        self.end = self._index(self.end_x, self.end_y)
+
+        # how far the start is from the goal, and the closest an expanded jump point has come so far
+        self.distance = max(abs(self.start_x - self.end_x), abs(self.start_y - self.end_y))
+        self.closest = self.distance
+
+        # handle obvious exception cases: either start or end is off the map or unreachable
+        if self.start is None or self.end is None or \
+                navmap.grid[self.start] == OBSTACLE or navmap.grid[self.end] == OBSTACLE:
+            self.done = True
+            self._release()
+            return
+
+        # Reset the scratch field in one copy, sources holds the jump-point predecessor to each point.
+        if template is None:
+            template = navmap.template
+        if field is None:
+            field = array('i', template)
+        else:
+            field[:] = template
+        for index in blocked:
+            field[index] = OBSTACLE
+        if sources is None:
+            sources = array('i', bytes(len(template) * template.itemsize))
+        self.field = field
+        self.sources = sources
+        field[self.start] = 0
+        field[self.end] = DESTINATION
+
+        self.queue = FastPriorityQueue()
+        self._queueJumpPoint(self.start)
+
+    @classmethod
+    def finished(cls, path):
+        """ A search that is already done, for answers that didn't need one """
+        search = cls.__new__(cls)
+        search.release = None
+        search.path = path
+        search.done = True
+        search.cancelled = False
+        search.expansions = 0
+        search.distance = search.closest = 0
+        return search
+
+    def _index(self, x, y):
+        """ Flat index of the map cell x, y or None if it is off the map """
+        if 0 <= x < self.navmap.width and 0 <= y < self.navmap.height:
+            return (x + 1) * self.stride + y + 1
+        return None
+
+    @property
+    def progress(self):
+        """ A rough estimate from 0 to 1 of how close the search has come to the goal """
+        if self.done:
+            return 1.0
+        if self.distance == 0:
+            return 0.0
+        return 1.0 - self.closest / self.distance
+
+    def step(self, budget=None):
+        """
+        Expand up to budget jump points, or run to the end if budget is None.
+
+        Return
+        True once the search is finished, path then holds the result (None if there is no path)
         """
-        Explores field along the diagonal direction for JPS, starting at point (startX, startY)
+        if self.done:
+            return True
+
+        # Main loop: iterate through the queue
+        while not self.queue.empty():
+            if budget is not None:
+                if budget <= 0:
+                    return False
+                budget -= 1
+
+            p = self.queue.pop_task()
+            self.expansions += 1
+            x, y = divmod(p, self.stride)
+            self.closest = min(self.closest, max(abs(x - 1 - self.end_x), abs(y - 1 - self.end_y)))
+
+            try:
+                self._queueJumpPoint(self._exploreCardinal(p, 1, 0))
+                self._queueJumpPoint(self._exploreCardinal(p, -1, 0))
+                self._queueJumpPoint(self._exploreCardinal(p, 0, 1))
+                self._queueJumpPoint(self._exploreCardinal(p, 0, -1))
+
+                self._queueJumpPoint(self._exploreDiagonal(p, 1, 1))
+                self._queueJumpPoint(self._exploreDiagonal(p, 1, -1))
+                self._queueJumpPoint(self._exploreDiagonal(p, -1, 1))
+                self._queueJumpPoint(self._exploreDiagonal(p, -1, -1))
+            except FoundPath:
+                self.path = _getPath(self.sources, self.stride, self.start, self.end)
+                break
+
+        self.done = True
+        self._release()
+        return True
+
+    def cancel(self):
+        """ Give up on the search, it counts as finished without a path """
+        self.cancelled = True
+        self.done = True
+        self.path = None
+        self._release()
+
+    def _release(self):
+        """ Hand the scratch buffers back, once """
+        if self.release is not None:
+            release, self.release = self.release, None
+            release(self.field, self.sources)
+            self.field = self.sources = None
+
+    def _exploreDiagonal(self, start, directionX, directionY):
+        """
+        Explores field along the diagonal direction for JPS, starting at the cell with flat index start
 
         Parameters
-        startX, startY - the coordinates to start exploring from. 
+        start - the flat index of the cell to start exploring from.
         directionX, directionY - an element from: {(1, 1), (-1, 1), (-1, -1), (1, -1)} corresponding to the x and y directions respectively. 
 
         Return
-        A 2-tuple containing the coordinates of the jump point if it found one
+        The flat index of the jump point if it found one
         None if no jumppoint was found. 
         """
-        cur_x, cur_y = startX, startY  # indices of current cell.
-        curCost = self.field[startX][startY]
+        field = self.field
+        sources = self.sources
+        stepX = directionX * self.stride
+        step = stepX + directionY
+        cur = start  # index of current cell.
+        curCost = field[start]
 
         while True:
-            cur_x += directionX
-            cur_y += directionY
+            cur += step
             curCost += 1
 
-            if self.field[cur_x][cur_y] == UNINITIALIZED:
-                self.field[cur_x][cur_y] = curCost
-                self.sources[cur_x][cur_y] = startX, startY
-            elif cur_x == self.end_x and cur_y == self.end_y:  # destination found
-                self.field[cur_x][cur_y] = curCost
-                self.sources[cur_x][cur_y] = startX, startY
+            if field[cur] == UNINITIALIZED:
+                field[cur] = curCost
+                sources[cur] = start
+            elif cur == self.end:  # destination found
+                field[cur] = curCost
+                sources[cur] = start
                 raise FoundPath()
             else:  # collided with an obstacle. We are done.
                 return None
 
             # If a jump point is found, 
-            if self.field[cur_x + directionX][cur_y] == OBSTACLE and self.field[cur_x + directionX][
-                cur_y + directionY] != OBSTACLE:
-                return cur_x, cur_y
+            if field[cur + stepX] == OBSTACLE and field[cur + step] != OBSTACLE:
+                return cur
             else:  # otherwise, extend a horizontal "tendril" to probe the field.
-                self._queueJumpPoint(self._exploreCardinal(cur_x, cur_y, directionX, 0))
+                self._queueJumpPoint(self._exploreCardinal(cur, directionX, 0))
 
-            if self.field[cur_x][cur_y + directionY] == OBSTACLE and self.field[cur_x + directionX][
-                cur_y + directionY] != OBSTACLE:
-                return cur_x, cur_y
+            if field[cur + directionY] == OBSTACLE and field[cur + step] != OBSTACLE:
+                return cur
             else:  # extend a vertical search to look for anything
-                self._queueJumpPoint(self._exploreCardinal(cur_x, cur_y, 0, directionY))
+                self._queueJumpPoint(self._exploreCardinal(cur, 0, directionY))
 
-    def _exploreCardinal(self, startX, startY, directionX, directionY):
+    def _exploreCardinal(self, start, directionX, directionY):
         """
-        Explores field along a cardinal direction for JPS (north/east/south/west), starting at point (startX, startY)
+        Explores field along a cardinal direction for JPS (north/east/south/west), starting at the cell with flat index start
 
         Parameters
-        startX, startY - the coordinates to start exploring from. 
-        directionX, directionY - an element from: {(1, 1), (-1, 1), (-1, -1), (1, -1)} corresponding to the x and y directions respectively. 
+        start - the flat index of the cell to start exploring from.
+        directionX, directionY - an element from: {(1, 0), (-1, 0), (0, 1), (0, -1)} corresponding to the x and y directions respectively. 
 
         Result: 
-        A 2-tuple containing the coordinates of the jump point if it found one
+        The flat index of the jump point if it found one
         None if no jumppoint was found.
         """
-        cur_x, cur_y = startX, startY  # indices of current cell.
-        curCost = self.field[startX][startY]
+        field = self.field
+        sources = self.sources
+        stride = self.stride
+        step = directionX * stride + directionY
+        cur = start  # index of current cell.
+        curCost = field[start]
 
         while True:
-            cur_x += directionX
-            cur_y += directionY
+            cur += step
             curCost += 1
 
-            if self.field[cur_x][cur_y] == UNINITIALIZED:
-                self.field[cur_x][cur_y] = curCost
-                self.sources[cur_x][cur_y] = startX, startY
-            elif cur_x == self.end_x and cur_y == self.end_y:  # destination found
-                self.field[cur_x][cur_y] = curCost
-                self.sources[cur_x][cur_y] = startX, startY
+            if field[cur] == UNINITIALIZED:
+                field[cur] = curCost
+                sources[cur] = start
+            elif cur == self.end:  # destination found
+                field[cur] = curCost
+                sources[cur] = start
                 raise FoundPath()
             else:  # collided with an obstacle or previously explored part. We are done.
                 return None
 
-            # check neighbouring cells, i.e. check if cur_x, cur_y is a jump point.
+            # check neighbouring cells, i.e. check if cur is a jump point.
             if directionX == 0:
-                if self.field[cur_x + 1][cur_y] == OBSTACLE and self.field[cur_x + 1][cur_y + directionY] != OBSTACLE:
-                    return cur_x, cur_y
-                if self.field[cur_x - 1][cur_y] == OBSTACLE and self.field[cur_x - 1][cur_y + directionY] != OBSTACLE:
-                    return cur_x, cur_y
+                if field[cur + stride] == OBSTACLE and field[cur + stride + directionY] != OBSTACLE:
+                    return cur
+                if field[cur - stride] == OBSTACLE and field[cur - stride + directionY] != OBSTACLE:
+                    return cur
             elif directionY == 0:
-                if self.field[cur_x][cur_y + 1] == OBSTACLE and self.field[cur_x + directionX][cur_y + 1] != OBSTACLE:
-                    return cur_x, cur_y
-                if self.field[cur_x][cur_y - 1] == OBSTACLE and self.field[cur_x + directionX][cur_y - 1] != OBSTACLE:
-                    return cur_x, cur_y
+                if field[cur + 1] == OBSTACLE and field[cur + step + 1] != OBSTACLE:
+                    return cur
+                if field[cur - 1] == OBSTACLE and field[cur + step - 1] != OBSTACLE:
+                    return cur
 
-    def _queueJumpPoint(self, xy):
+    def _queueJumpPoint(self, index):
         """
         Add a jump point to the priority queue to be searched later. The priority is the minimum possible number of steps to the destination. 
         Also check whether the search is finished.
 
         Parameters
-        self.queue - a priority queue for the jump point search
-        xy - 2-tuple with the coordinates of a point to add.
+        index - flat index of a point to add.
 
         Return
         None
         """
-        if xy is not None:
-            self.queue.add_task(xy, self.field[xy[0]][xy[1]] + max(abs(xy[0] - self.end_x), abs(xy[1] - self.end_y)))
+        if index is not None:
+            x, y = divmod(index, self.stride)
+            self.queue.add_task(index, self.field[index] + max(abs(x - 1 - self.end_x), abs(y - 1 - self.end_y)))
+
+
+class Pathfinder:
+    def __init__(self, mode=JPS, cache_size=0, cluster_size=10, clearance=0):
+
+        # JPS runs a search per query, FLOW answers every query toward the same goal from one shared field,
+        # HPA searches a precomputed graph of cluster entrances and refines the result cluster by cluster,
+        # JPS_PLUS jumps between jump points using distances precomputed for the whole map
+        self.mode = mode
+
+        # the HPA abstraction, built (or loaded from next to the map) when a map is loaded in HPA mode
+        self.cluster_size = cluster_size
+        self.hierarchy = None
+
+        # the JPS+ jump distance table, built (or loaded from next to the map) when a map is loaded in JPS_PLUS mode
+        self.jump_table = None
+
+        # optional LRU cache of finished paths keyed on (start cell, goal cell, clearance), 0 disables it
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        # jump points expanded by JPS searches so far
+        self.expansions = 0
+
+        # the minimum clearance (see buildClearance) queries ask for unless they say otherwise. The clearance
+        # map is built as soon as a map is loaded if this is above 1, otherwise on the first query that needs it.
+        self.clearance = clearance
+
+        # moving obstacles searched on top of the map, and the cells they changed since the last query. The
+        # overlay marks cells from the game's thread while the pathfinder may be searching in a PathService worker.
+        self.overlay = None
+        self.dirty = set()
+        self._dirtyLock = threading.Lock()
+
+        # the shared map and shortcuts to its grid
+        self.navmap = None
+        self.grid = None
+        self.width = 0
+        self.height = 0
+        self.stride = 0
+
+        # scratch buffers reused by every search, and spare ones for the time-sliced searches in progress
+        self._template = None
+        self.field = None
+        self.sources = None
+        self._searchBuffers = []
+
+        # flow field toward flow_goal, flow[i] is the index of the next cell on the way to the goal
+        self.flow = None
+        self.flow_distance = None
+        self.flow_goal = None
+        self.flow_valid = False
+
+    @property
+    def nav_map(self):
+        """ The loaded map as a list of lists, nav_map[x][y] """
+        if self.grid is None:
+            return None
+        stride = self.stride
+        return [self.grid[(x + 1) * stride + 1:(x + 1) * stride + 1 + self.height].tolist()
+                for x in range(self.width)]
+
+    def useMap(self, navmap, changed=None):
+        """
+        Search navmap from now on, (re)allocating the search buffers. Precomputed data needed by the current mode
+        is taken from navmap if another pathfinder already built it.
+
+        Parameters
+        navmap - the map to search
+        changed - when navmap is a patched copy of the current map (see NavMap.patched), the flat indices it
+                  changed. Cached paths and the flow field are then only dropped where they cross them, and the
+                  overlay moves over with its stamps.
+        """
+        previous = self.navmap
+        patch = changed is not None and previous is not None and \
+            (previous.width, previous.height) == (navmap.width, navmap.height)
+        self.navmap = navmap
+        self.grid = navmap.grid
+        self.width = navmap.width
+        self.height = navmap.height
+        self.stride = navmap.stride
+
+        # field is reset from the template with a single buffer copy, sources never needs
+        # resetting since only cells written during the current search are ever read back
+        self._template = navmap.template
+
+        # an overlay only fits the map it was made for, it moves along when the map it was made for is swapped
+        if self.overlay is not None:
+            if self.overlay.navmap is previous and previous is not navmap:
+                self.overlay.useMap(navmap, changed if patch else None)
+            if self.overlay.navmap is navmap:
+                self.grid = self.overlay.grid
+                self._template = self.overlay.template
+            else:
+                self.overlay.removePathfinder(self)
+                self.overlay = None
+
+        self.field = array('i', self._template)
+        self.sources = array('i', bytes(len(self.grid) * self.field.itemsize))
+        self._searchBuffers = []
+
+        # the hierarchy and jump table always come from navmap
+        self.hierarchy = None
+        self.jump_table = None
+        if self.mode == HPA:
+            self.buildHierarchy()
+        elif self.mode == JPS_PLUS:
+            self.buildJumpTable()
+        elif self.mode == VISIBILITY:
+            self.buildVisibilityGraph()
+        if self.clearance > 1:
+            self.buildClearance()
+
+        if patch:
+            self.markDirty(changed)
+            return
+        with self._dirtyLock:
+            self.dirty = set()
+
+        # any cached path or flow field belongs to the previous map
+        self.clearCache()
+        self.flow = None
+        self.flow_distance = None
+        self.flow_goal = None
+        self.flow_valid = False
+
+    def useOverlay(self, overlay):
+        """
+        Search the map with overlay's moving obstacles stamped on it from now on, None goes back to the bare map.
+        HPA, JPS+ and the visibility graph still plan on the static map, and only fall back to a JPS search when
+        their path runs into a stamp.
+        """
+        if self.overlay is not None:
+            self.overlay.removePathfinder(self)
+        self.overlay = overlay
+        if overlay is not None:
+            overlay.addPathfinder(self)
+        if self.navmap is not None:
+            self.useMap(self.navmap)
+
+    def markDirty(self, cells):
+        """ Note cells the overlay or a map patch changed, safe from any thread """
+        with self._dirtyLock:
+            self.dirty.update(cells)
+
+    def _invalidate(self):
+        """
+        Drop the cached paths and flow field that cross a cell the overlay (or a map patch) changed since the last
+        query
+        """
+        if not self.dirty:
+            return
+        with self._dirtyLock:
+            dirty, self.dirty = self.dirty, set()
+
+        # a cleared cell may open a route where there was none, so failed searches go too
+        for key, path in list(self.cache.items()):
+            if path is None or not dirty.isdisjoint(_pathCells(path, self.stride)):
+                del self.cache[key]
+
+        if self.flow is not None and self.flow_goal is not None:
+            flow = self.flow
+            offsets = [dx * self.stride + dy for dx, dy in FLOW_DIRECTIONS]
+            for index in dirty:
+                if flow[index] != -1 or any(flow[index + offset] != -1 for offset in offsets):
+                    self.flow_goal = None
+                    self.flow_valid = False
+                    break
+
+    def _index(self, x, y):
+        """ Flat index of the map cell x, y or None if it is off the map """
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return (x + 1) * self.stride + y + 1
+        return None
 
     def loadMap(self, map_file):
-        # the map_file can be just a list
-        if type(map_file) is list:
-            self.nav_map = map_file
-        # it can also be a file
-        elif exists(map_file):
-            # ...a json file?
-            try:
-                with open(map_file) as f:
-                    self.nav_map = json.load(f)
-            except:
-                # ...an image?
-                try:
-                    img = PNMImage(map_file)
-                    max_x = img.getReadXSize()
-                    max_y = img.getReadYSize()
-                    temp_map = [[WALL for x in range(max_x)] for x in range(max_y)]
-                    for x in range(max_x):
-                        for y in range(max_y):
-                            if img.getRedVal(x, y) < 0.5:
-                                temp_map[x][max_y - 1 - y] = FREE
-                    self.nav_map = temp_map
-                except:
-                    print("Can't load map!")
+        navmap = readNavMap(map_file)
+        if navmap is not None:
+            self.useMap(navmap)
+
+    def buildHierarchy(self):
+        """
+        Build the HPA cluster graph for the loaded map. A graph saved next to the map file for this exact map is
+        loaded instead, and a freshly built one is saved there for next time.
+        """
+        from clustergraph import ClusterGraph
+
+        if self.navmap is None:
+            return
+        key = (HPA, self.cluster_size)
+        if key not in self.navmap.derived:
+            graph = ClusterGraph(self.navmap, self.cluster_size)
+            cache_file = self.navmap.cacheFile('.hpa.json')
+            if cache_file is None or not graph.load(cache_file):
+                graph.build()
+                if cache_file is not None:
+                    try:
+                        graph.save(cache_file)
+                    except:
+                        print("Can't save the HPA graph next to the map!")
+            self.navmap.derived[key] = graph
+        self.hierarchy = self.navmap.derived[key]
+
+    def buildJumpTable(self):
+        """
+        Build the JPS+ jump distance table for the loaded map. A table saved next to the map file for this exact
+        map is loaded instead, and a freshly built one is saved there for next time.
+        """
+        from jumptable import JumpTable
+
+        if self.navmap is None:
+            return
+        if JPS_PLUS not in self.navmap.derived:
+            table = JumpTable(self.navmap)
+            cache_file = self.navmap.cacheFile('.jps')
+            if cache_file is None or not table.load(cache_file):
+                table.build()
+                if cache_file is not None:
+                    try:
+                        table.save(cache_file)
+                    except:
+                        print("Can't save the JPS+ table next to the map!")
+            self.navmap.derived[JPS_PLUS] = table
+        self.jump_table = self.navmap.derived[JPS_PLUS]
+
+    def buildVisibilityGraph(self, clearance=None):
+        """
+        Build the corner waypoint visibility graph for the loaded map, keeping clearance (the pathfinder's if
+        None) from the walls. A graph saved next to the map file for this exact map is loaded instead, and a
+        freshly built one is saved there for next time. Maps with too many corners for it (mazes) get an empty
+        crowded graph and are searched with JPS instead.
+
+        Return
+        the VisibilityGraph
+        """
+        from visibilitygraph import VisibilityGraph
+
+        if self.navmap is None:
+            return None
+        clearance = self.clearance if clearance is None else clearance
+        clearance = clearance if clearance > 1 else 0
+        key = (VISIBILITY, clearance)
+        if key not in self.navmap.derived:
+            template = self._clearanceTemplate(clearance) if clearance else self.navmap.template
+            graph = VisibilityGraph(self.navmap, template, clearance)
+            cache_file = self.navmap.cacheFile('.vis%d.json' % clearance if clearance else '.vis.json')
+            if cache_file is None or not graph.load(cache_file):
+                graph.build()
+                if cache_file is not None:
+                    try:
+                        graph.save(cache_file)
+                    except:
+                        print("Can't save the visibility graph next to the map!")
+            self.navmap.derived[key] = graph
+        return self.navmap.derived[key]
+
+    def buildClearance(self):
+        """
+        Build the clearance map of the loaded map: for every cell, how many steps (diagonals included) away the
+        nearest wall is. Walls have 0, a free cell touching a wall has 1, and so on. An agent that needs
+        clearance c only goes through cells with at least c, see clearanceFor.
+
+        Return
+        the clearance map, an array indexed like the grid
+        """
+        if self.navmap is None:
+            return None
+        if CLEARANCE not in self.navmap.derived:
+            grid = self.navmap.grid
+            clearance = array('i', bytes(len(grid) * 4))
+            _chamfer(grid, clearance, self.stride, 1, self.width + 1, 1, self.height + 1)
+            self.navmap.derived[CLEARANCE] = clearance
+        return self.navmap.derived[CLEARANCE]
+
+    def clearanceFor(self, radius):
+        """ The clearance an agent of radius (in world units) needs to stand in the middle of a cell """
+        cell_size = self.navmap.cell_size if self.navmap is not None else 1.0
+        return max(math.ceil(radius / cell_size + 0.5), 0)
+
+    def _clearanceTemplate(self, clearance):
+        """ The search template with every cell that has less than clearance blocked, shared by the map's views """
+        key = (CLEARANCE, clearance)
+        if key not in self.navmap.derived:
+            template = array('i', self.navmap.template)
+            for index, value in enumerate(self.buildClearance()):
+                if value < clearance:
+                    template[index] = OBSTACLE
+            self.navmap.derived[key] = template
+        return self.navmap.derived[key]
 
     def saveMap(self, name):
-        if self.nav_map:
+        if self.grid is not None:
             with open(name, 'w') as outfile:
                 json.dump(self.nav_map, outfile)
 
-    def getPath(self, start, end):
-        if self.nav_map:
-            self.field = [[j for j in i] for i in self.nav_map]  # this takes less time than deep copying(?)        
-            self.start_x = int(start[0])
-            self.start_y = int(start[1])
-            self.end_x = int(end[0])
-            self.end_y = int(end[1])
+    def updateFlowField(self, goal, clearance=None):
+        """
+        Recompute the flow field toward goal, but only if goal moved to a different cell (or the clearance
+        changed) since the last call. Every cell that can reach the goal stores the neighbour one step closer
+        to it, so any number of agents can look up their next waypoint without running a search of their own.
+
+        Parameters
+        goal - the x, y coordinates everything should flow toward
+        clearance - the minimum clearance of the cells the field routes through, the pathfinder's if None
 
-            # handle obvious exception cases: either start or end is unreachable
-            if self.field[self.start_x][self.start_y] == OBSTACLE:
-                return None
-            if self.field[self.end_x][self.end_y] == OBSTACLE:
-                return None
+        Return
+        True if the field is usable, False if the goal is off the map or inside an obstacle
+        """
+        if self.grid is None:
+            return False
+        self._invalidate()
+        clearance = self.clearance if clearance is None else clearance
+
+        goal_cell = (int(goal[0]), int(goal[1]))
+        if (goal_cell, clearance) == self.flow_goal:
+            return self.flow_valid
+
+        self.flow_goal = (goal_cell, clearance)
+        goal_index = self._index(*goal_cell)
+        if goal_index is None or self.navmap.grid[goal_index] == OBSTACLE:
+            self.flow_valid = False
+            return False
+
+        self._growField(goal_index, clearance=clearance)
+        self.flow_valid = True
+        return True
+
+    def _growField(self, goal_index, targets=None, clearance=0):
+        """
+        Breadth first from goal_index, filling flow with the neighbour one step closer to the goal and flow_distance
+        with the number of steps. Every step (diagonals included) costs 1 just like the JPS search. Cells blocked
+        only by the overlay or a lack of clearance get a way out but nothing is routed through them.
 
-            # MAIN JPS FUNCTION           
-            # Initialize some arrays and certain elements. 
-            self.sources = [[(None, None) for i in self.field[0]] for j in
-                            self.field]  # the jump-point predecessor to each point.
-            self.field[self.start_x][self.start_y] = 0
-            self.field[self.end_x][self.end_y] = DESTINATION
-
-            self.queue = FastPriorityQueue()
-            self._queueJumpPoint((self.start_x, self.start_y))
-
-            # Main loop: iterate through the queue
-            while not self.queue.empty():
-                pX, pY = self.queue.pop_task()
-
-                try:
-                    self._queueJumpPoint(self._exploreCardinal(pX, pY, 1, 0))
-                    self._queueJumpPoint(self._exploreCardinal(pX, pY, -1, 0))
-                    self._queueJumpPoint(self._exploreCardinal(pX, pY, 0, 1))
-                    self._queueJumpPoint(self._exploreCardinal(pX, pY, 0, -1))
-
-                    self._queueJumpPoint(self._exploreDiagonal(pX, pY, 1, 1))
-                    self._queueJumpPoint(self._exploreDiagonal(pX, pY, 1, -1))
-                    self._queueJumpPoint(self._exploreDiagonal(pX, pY, -1, 1))
-                    self._queueJumpPoint(self._exploreDiagonal(pX, pY, -1, -1))
-                except FoundPath:
-                    return _getPath(self.sources, self.start_x, self.start_y, self.end_x, self.end_y)
+        Parameters
+        goal_index - flat index of the free cell to grow the field from
+        targets    - optional flat indices, the search stops as soon as all of them are reached
+        clearance  - the minimum clearance of the cells routed through
+        """
+        grid = self.grid
+        static = self.navmap.grid
+        room = self.buildClearance() if clearance > 1 else None
+        if self.flow is None:
+            self._flowBlank = array('i', [-1]) * len(grid)
+            self.flow = array('i', self._flowBlank)
+            self.flow_distance = array('i', self._flowBlank)
+        else:
+            self.flow[:] = self._flowBlank
+        flow = self.flow
+        distance = self.flow_distance
+
+        remaining = set(targets) if targets is not None else None
+        if remaining is not None:
+            remaining.discard(goal_index)
+
+        offsets = [dx * self.stride + dy for dx, dy in FLOW_DIRECTIONS]
+        flow[goal_index] = goal_index
+        distance[goal_index] = 0
+        frontier = [goal_index]
+        steps = 0
+        while frontier and (remaining is None or remaining):
+            steps += 1
+            next_frontier = []
+            for cur in frontier:
+                for offset in offsets:
+                    n = cur + offset
+                    if flow[n] == -1 and static[n] != OBSTACLE:
+                        flow[n] = cur
+                        distance[n] = steps
+                        if grid[n] != OBSTACLE and (room is None or room[n] >= clearance):
+                            next_frontier.append(n)
+                        if remaining:
+                            remaining.discard(n)
+            frontier = next_frontier
+
+    def getNextWaypoint(self, start, end, clearance=None):
+        """
+        Look up the next cell to move to from start on the way to end using the shared flow field.
+
+        Return
+        a 2-tuple with the coordinates of the next cell, end itself once start is at the goal
+        None if there is no route from start to end
+        """
+        if not self.updateFlowField(end, clearance):
             return None
-        return None
+        index = self._index(int(start[0]), int(start[1]))
+        if index is None or self.flow[index] == -1:
+            return None
+        x, y = divmod(self.flow[index], self.stride)
+        return x - 1, y - 1
+
+    def _traceFlow(self, start):
+        """ Follow the current flow field from the flat index start, None if start can't reach the goal """
+        flow = self.flow
+        if start is None or flow[start] == -1:
+            return None
+        cells = [start]
+        while flow[start] != start:
+            start = flow[start]
+            cells.append(start)
+        return _compressPath(cells, self.stride)
+
+    def getPaths(self, starts, end, clearance=None):
+        """
+        Find paths from many starts to one goal with a single backward search from the goal, e.g. for every enemy
+        that needs to repath toward the player this frame.
+
+        Parameters
+        starts - a list of x, y start coordinates
+        end    - the x, y coordinates of the shared goal
+        clearance - the minimum clearance every path keeps, the pathfinder's if None
+
+        Return
+        a list with one path (in the same shape getPath returns) or None for every start, in the same order
+        """
+        if self.grid is None:
+            return [None for _ in starts]
+        self._invalidate()
+
+        clearance = self.clearance if clearance is None else clearance
+        if self.mode == VISIBILITY and not self.buildVisibilityGraph(clearance).crowded:
+            # the goal's waypoints are remembered after the first start, so each path is only a lookup
+            return [self.getPath(start, end, clearance) for start in starts]
+        indices = [self._index(int(start[0]), int(start[1])) for start in starts]
+        if self.mode == FLOW:
+            if not self.updateFlowField(end, clearance):
+                return [None for _ in starts]
+        else:
+            goal_index = self._index(int(end[0]), int(end[1]))
+            static = self.navmap.grid
+            if goal_index is None or static[goal_index] == OBSTACLE:
+                return [None for _ in starts]
+            self._growField(goal_index, [i for i in indices if i is not None and static[i] != OBSTACLE], clearance)
+            # the field stopped early, so it can't answer any later query
+            self.flow_goal = None
+            self.flow_valid = False
+
+        return [self._traceFlow(index) for index in indices]
+
+    def _getFlowPath(self, start, end, clearance):
+        """
+        Follow the flow field from start to end, keeping only the cells where the direction changes so the
+        result has the same shape as a JPS path.
+        """
+        if not self.updateFlowField(end, clearance):
+            return None
+        return self._traceFlow(self._index(int(start[0]), int(start[1])))
+
+    def _blocked(self, x, y, grid=None, room=None, clearance=0):
+        index = self._index(x, y)
+        if index is None or (self.grid if grid is None else grid)[index] == OBSTACLE:
+            return True
+        return room is not None and room[index] < clearance
+
+    def hasLineOfSight(self, start, end, clearance=0):
+        """
+        Walk every cell the straight segment from start to end passes through (a supercover line, so a segment
+        going exactly through a corner needs both cells beside it free).
+
+        Parameters
+        start, end - x, y points in map coordinates, cell x, y covers [x, x + 1) x [y, y + 1)
+        clearance - the minimum clearance of every cell between the ends
+
+        Return
+        True if every cell on the segment is free
+        """
+        if self.grid is None:
+            return False
+
+        x0, y0 = float(start[0]), float(start[1])
+        x1, y1 = float(end[0]), float(end[1])
+        cur_x, cur_y = math.floor(x0), math.floor(y0)
+        end_x, end_y = math.floor(x1), math.floor(y1)
+        # the ends may stand inside an overlay stamp or too close to a wall, only the static map counts there
+        static = self.navmap.grid
+        room = self.buildClearance() if clearance > 1 else None
+        if self._blocked(cur_x, cur_y, static):
+            return False
+
+        dx = x1 - x0
+        dy = y1 - y0
+        step_x = 1 if dx > 0 else -1
+        step_y = 1 if dy > 0 else -1
+        # how far along the segment (0 to 1) the next x / y cell border is, and the distance between borders
+        delta_x = abs(1 / dx) if dx else math.inf
+        delta_y = abs(1 / dy) if dy else math.inf
+        next_x = ((cur_x + 1 - x0) if dx > 0 else (x0 - cur_x)) * delta_x
+        next_y = ((cur_y + 1 - y0) if dy > 0 else (y0 - cur_y)) * delta_y
+
+        for _ in range(abs(end_x - cur_x) + abs(end_y - cur_y)):
+            if cur_x == end_x and cur_y == end_y:
+                break
+            if next_x < next_y:
+                cur_x += step_x
+                next_x += delta_x
+            elif next_y < next_x:
+                cur_y += step_y
+                next_y += delta_y
+            else:  # exactly through a corner
+                if self._blocked(cur_x + step_x, cur_y, None, room, clearance) or \
+                        self._blocked(cur_x, cur_y + step_y, None, room, clearance):
+                    return False
+                cur_x += step_x
+                cur_y += step_y
+                next_x += delta_x
+                next_y += delta_y
+            if cur_x == end_x and cur_y == end_y:
+                if self._blocked(cur_x, cur_y, static):
+                    return False
+            elif self._blocked(cur_x, cur_y, None, room, clearance):
+                return False
+        return True
+
+    def smoothPath(self, path, clearance=0):
+        """
+        String pull a path: drop every waypoint that the previous kept waypoint can see past (keeping clearance).
+
+        Return
+        a new list with the start, the waypoints that are still needed, and the end
+        """
+        if path is None or len(path) < 3:
+            return path
+
+        result = [path[0]]
+        anchor = (path[0][0] + 0.5, path[0][1] + 0.5)
+        for point, after in zip(path[1:], path[2:]):
+            if not self.hasLineOfSight(anchor, (after[0] + 0.5, after[1] + 0.5), clearance):
+                result.append(point)
+                anchor = (point[0] + 0.5, point[1] + 0.5)
+        result.append(path[-1])
+        return result
+
+    def _getHierarchicalPath(self, start, end):
+        if self.grid is None:
+            return None
+        if self.hierarchy is None:
+            self.buildHierarchy()
+        start = self._index(int(start[0]), int(start[1]))
+        end = self._index(int(end[0]), int(end[1]))
+        if start is None or end is None or self.navmap.grid[start] == OBSTACLE or self.navmap.grid[end] == OBSTACLE:
+            return None
+        return self.hierarchy.getPath(start, end)
+
+    def _getJumpTablePath(self, start, end):
+        if self.grid is None:
+            return None
+        if self.jump_table is None:
+            self.buildJumpTable()
+        start = self._index(int(start[0]), int(start[1]))
+        end = self._index(int(end[0]), int(end[1]))
+        if start is None or end is None or self.navmap.grid[start] == OBSTACLE or self.navmap.grid[end] == OBSTACLE:
+            return None
+        return self.jump_table.getPath(start, end)
+
+    def _getVisibilityPath(self, start, end, clearance):
+        if self.grid is None:
+            return None
+        graph = self.buildVisibilityGraph(clearance)
+        start = self._index(int(start[0]), int(start[1]))
+        end = self._index(int(end[0]), int(end[1]))
+        if start is None or end is None or self.navmap.grid[start] == OBSTACLE or self.navmap.grid[end] == OBSTACLE:
+            return None
+        return graph.getPath(start, end)
+
+    def clearCache(self):
+        """ Forget every cached path, the hit/miss counters are kept """
+        self.cache.clear()
+
+    def getPath(self, start, end, clearance=None):
+        """
+        Find a path from start to end that only goes through cells with at least clearance (the pathfinder's
+        if None).
+
+        Return
+        a list of waypoints as 2-tuples, from the start cell to the end cell, None if there is no path
+        """
+        self._invalidate()
+        clearance = self.clearance if clearance is None else clearance
+        if self.cache_size <= 0:
+            return self._search(start, end, clearance)
+
+        key = (int(start[0]), int(start[1])), (int(end[0]), int(end[1])), clearance
+        if key in self.cache:
+            self.cache_hits += 1
+            self.cache.move_to_end(key)
+            path = self.cache[key]
+        else:
+            self.cache_misses += 1
+            path = self._search(*key)
+            # store an immutable copy so callers can't corrupt the cached entry
+            if path is not None:
+                path = tuple(path)
+            self.cache[key] = path
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        return list(path) if path is not None else None
+
+    def _search(self, start, end, clearance):
+        if self.mode == FLOW:
+            return self._getFlowPath(start, end, clearance)
+        if self.mode in (HPA, JPS_PLUS) or (self.mode == VISIBILITY and
+                                            not self.buildVisibilityGraph(clearance).crowded):
+            if self.mode == HPA:
+                path = self._getHierarchicalPath(start, end)
+            elif self.mode == JPS_PLUS:
+                path = self._getJumpTablePath(start, end)
+            else:
+                path = self._getVisibilityPath(start, end, clearance)
+            # stamps and clearance only ever block, so only a path through a blocked cell needs searching again
+            if path is None or not self._crossesBlocked(path, clearance):
+                return path
+
+        if self.navmap is None:
+            return None
+        search = PathSearch(self.navmap, start, end, self.field, self.sources, *self._searchTemplate(clearance))
+        search.step()
+        self.expansions += search.expansions
+        return search.path
+
+    def startSearch(self, start, end, clearance=None):
+        """
+        Start a search that the caller advances with step(budget), e.g. a few jump points every frame.
+        Only JPS searches are time-sliced, the other modes answer straight away.
+
+        Return
+        a PathSearch with its own scratch buffers, taken from (and handed back to) this pathfinder's spares
+        """
+        if self.navmap is None:
+            return PathSearch.finished(None)
+        if self.mode != JPS:
+            return PathSearch.finished(self.getPath(start, end, clearance))
+        self._invalidate()
+        clearance = self.clearance if clearance is None else clearance
+        template, blocked = self._searchTemplate(clearance)
+        field, sources = self._searchBuffers.pop() if self._searchBuffers else (None, None)
+        return PathSearch(self.navmap, start, end, field, sources, template, blocked, self._releaseSearchBuffers)
+
+    def _releaseSearchBuffers(self, field, sources):
+        """ Keep a finished time-sliced search's buffers for the next one, unless they're for a previous map """
+        if field is not None and len(field) == len(self.grid):
+            self._searchBuffers.append((field, sources))
+
+    def _searchTemplate(self, clearance):
+        """ The template a JPS search with clearance starts from, and the overlay cells to block on top of it """
+        if clearance <= 1:
+            return self._template, ()
+        return self._clearanceTemplate(clearance), (list(self.overlay.counts) if self.overlay is not None else ())
+
+    def _crossesBlocked(self, path, clearance):
+        """
+        Does path pass through a cell stamped by the overlay or with less than clearance? Its first and last cells
+        don't count
+        """
+        if clearance <= 1 and (self.overlay is None or not self.overlay.counts):
+            return False
+        grid = self.grid
+        room = self.buildClearance() if clearance > 1 else None
+        cells = list(_pathCells(path, self.stride))
+        return any(grid[index] == OBSTACLE or (room is not None and room[index] < clearance) for index in cells[1:-1])
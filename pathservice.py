@@ -0,0 +1,185 @@
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from direct.showbase.DirectObject import DirectObject
+
+from pathfinder import Pathfinder
+
+# each worker thread (or process) has its own pathfinder over the read-only map
+_worker = threading.local()
+
+
+def _initWorker(navmap, mode, overlay=None, clearance=0):
+    _worker.pathfinder = Pathfinder(mode=mode, clearance=clearance)
+    _worker.pathfinder.useMap(navmap)
+    if overlay is not None:
+        _worker.pathfinder.useOverlay(overlay)
+
+
+def _findPaths(starts, end, clearance=None):
+    return _worker.pathfinder.getPaths(starts, end, clearance)
+
+
+class PathService(DirectObject):
+    """
+    Runs path requests on a worker pool so a long search never stalls the render loop.
+    Requests made during a frame are batched by goal cell (and clearance), so every enemy heading for the player
+    costs one backward search (Pathfinder.getPaths) per frame between them. Results are handed back
+    through the requester's callback from a per-frame task, at most deliveryBudget of them per frame.
+
+    Threads are the default, they share the GIL with the game but let the frame finish while a
+    search runs. Pass processes=True to search truly in parallel at the cost of pickling requests.
+
+    The workers search their own pathfinders, not registry views, so when the pathfinder is moved to a new
+    version of its map (NavMapRegistry.reload or patch) the pool is started again on it. Searches already
+    running finish on the old map.
+    """
+
+    def __init__(self, pathfinder: Pathfinder, workers=2, deliveryBudget=8, processes=False):
+        DirectObject.__init__(self)
+
+        self.pathfinder = pathfinder
+        self.workers = workers
+        self.processes = processes
+        self.pool = None
+        self.navmap = None  # the map the pool was started on
+        self.overlay = None
+        self._startPool()
+
+        self.deliveryBudget = deliveryBudget
+
+        # owner -> (request id, submit time), one outstanding request per owner
+        self.pending = {}
+        self.callbacks = {}
+        self.batches = {}  # (goal cell, clearance) -> [(owner, request id, start)] requested this frame
+        self.ready = deque()  # (owner, request id, future, position in batch), appended from the worker threads
+        self.ids = itertools.count()
+
+        # stats
+        self.requested = 0
+        self.searches = 0
+        self.delivered = 0
+        self.cancelled = 0
+        self.totalLatency = 0
+        self.maxLatency = 0
+
+        self.add_task(self.deliver, 'path_service')
+
+    def _startPool(self):
+        """ (Re)start the workers on the pathfinder's current map and overlay """
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+
+        # the workers share the pathfinder's map (threads) or get a copy of it (processes), but never its
+        # scratch buffers. Only threads can see the pathfinder's overlay of moving obstacles.
+        pathfinder = self.pathfinder
+        pool = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+        self.navmap = pathfinder.navmap
+        self.overlay = None if self.processes else pathfinder.overlay
+        self.pool = pool(max_workers=self.workers, initializer=_initWorker,
+                         initargs=(self.navmap, pathfinder.mode, self.overlay, pathfinder.clearance))
+
+    def request(self, owner, start, end, callback, clearance=None):
+        """
+        Queue a search from start to end for owner, replacing any request owner still has pending.
+        callback(path) is called on a later frame with the path, or None if there is no route.
+        clearance is the minimum clearance the path keeps, the pathfinder's if None.
+        """
+        self.cancel(owner, count=False)
+
+        request_id = next(self.ids)
+        goal = (int(end[0]), int(end[1]))
+        self.batches.setdefault((goal, clearance), []).append((owner, request_id, (start[0], start[1])))
+        self.pending[owner] = (request_id, time.perf_counter())
+        self.callbacks[owner] = callback
+        self.requested += 1
+        return request_id
+
+    def flush(self):
+        """ Submit one search per goal for everything requested since the last flush """
+        if self.pathfinder.navmap is not self.navmap or \
+                (not self.processes and self.pathfinder.overlay is not self.overlay):
+            self._startPool()
+
+        for (goal, clearance), batch in self.batches.items():
+            # drop requests that were cancelled or replaced before they were sent
+            batch = [entry for entry in batch if self.pending.get(entry[0], (None,))[0] == entry[1]]
+            if not batch:
+                continue
+
+            future = self.pool.submit(_findPaths, [start for _, _, start in batch], goal, clearance)
+            self.searches += 1
+
+            def done(f, batch=batch):
+                for position, (owner, request_id, _) in enumerate(batch):
+                    self.ready.append((owner, request_id, f, position))
+            future.add_done_callback(done)
+        self.batches = {}
+
+    def isPending(self, owner):
+        return owner in self.pending
+
+    def cancel(self, owner, count=True):
+        """ Drop owner's outstanding request, e.g. because the enemy died """
+        entry = self.pending.pop(owner, None)
+        self.callbacks.pop(owner, None)
+        if entry is not None and count:
+            self.cancelled += 1
+
+    def deliver(self, task):
+        self.flush()
+
+        budget = self.deliveryBudget
+        while budget > 0 and self.ready:
+            owner, request_id, future, position = self.ready.popleft()
+            entry = self.pending.get(owner)
+
+            # stale result of a cancelled or replaced request
+            if entry is None or entry[0] != request_id:
+                continue
+
+            _, submitted = self.pending.pop(owner)
+            callback = self.callbacks.pop(owner)
+
+            try:
+                path = future.result()[position]
+            except Exception:
+                path = None
+
+            latency = time.perf_counter() - submitted
+            self.totalLatency += latency
+            self.maxLatency = max(self.maxLatency, latency)
+            self.delivered += 1
+            budget -= 1
+
+            callback(path)
+
+        return task.cont
+
+    @property
+    def queueDepth(self):
+        """ Requests submitted but not delivered yet """
+        return len(self.pending)
+
+    def stats(self):
+        return {
+            'queueDepth': self.queueDepth,
+            'readyDepth': len(self.ready),
+            'requested': self.requested,
+            'searches': self.searches,
+            'delivered': self.delivered,
+            'cancelled': self.cancelled,
+            'meanLatency': self.totalLatency / self.delivered if self.delivered else 0,
+            'maxLatency': self.maxLatency,
+        }
+
+    def destroy(self):
+        self.removeAllTasks()
+        self.ignoreAll()
+        self.pending.clear()
+        self.callbacks.clear()
+        self.batches.clear()
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -16,10 +16,11 @@ from resourcepath import resource_path
 from verticalbar import UISlider
 
 from bulletmanager import BulletManager
+from collisionevents import PLAYER, WALL, ENEMY_TOUCH_PLAYER, PLAYER_CONTACT, PLAYER_TOUCH_CRYSTAL, tag
 
 
 class PlayerController(DirectObject):
-    def __init__(self, camera: NodePath, win, position=Vec3(0, 0, 0)):
+    def __init__(self, camera: NodePath, win, position=Vec3(0, 0, 0), events=None):
         DirectObject.__init__(self)
         self.camera = camera
         self.win = win
@@ -42,7 +43,6 @@ class PlayerController(DirectObject):
         self.accept('f', self.toggle_fullscreen)
         self.add_task(self.move, "move")
         self.add_task(self.rotate, "rotate")
-        self.add_task(self.collision_check, 'collision_check')
         self.add_task(self.handle_mouse, 'mouse')
 
         # Add Physics
@@ -52,6 +52,7 @@ class PlayerController(DirectObject):
         self.playerRB = BulletRigidBodyNode('Player')
         self.playerRB.setMass(0.1)
         self.playerRB.addShape(shape)
+        tag(self.playerRB, PLAYER, self)
         base.world.attachRigidBody(self.playerRB)
         self.playerRBNode = base.render.attachNewNode(self.playerRB)
         self.playerRBNode.setPos(position)
@@ -85,11 +86,22 @@ class PlayerController(DirectObject):
         self.canJump = True
         self.fullscreen = False
 
+        # contacts come from the game's CollisionEvents after each physics step
+        self.events = events if events is not None else base.collisionEvents
+        self.events.accept(PLAYER_TOUCH_CRYSTAL, self.pick_up)
+        self.events.accept(ENEMY_TOUCH_PLAYER, self.hurt)
+        self.events.accept(PLAYER_CONTACT, self.touch)
+        self.grounded = False  # touched something below the player's middle since the last move
+
         # Loading sound effects
         self.redChime = base.loader.loadSfx(resource_path("Assets/assets/Sound/Effects/redChime.mp3"))
         self.greenChime = base.loader.loadSfx(resource_path("Assets/assets/Sound/Effects/greenChime.mp3"))
         self.blueChime = base.loader.loadSfx(resource_path("Assets/assets/Sound/Effects/blueChime.mp3"))
 
+        # crystal name -> the meter it fills and the chime it plays
+        self.crystalMeters = {'red_crystal': ('r', self.redChime), 'green_crystal': ('g', self.greenChime),
+                              'blue_crystal': ('b', self.blueChime)}
+
         self.footsteps = base.loader.loadSfx(resource_path("Assets/assets/Sound/Effects/footsteps.mp3"))
         self.footsteps.setLoop(True)
 
@@ -255,16 +267,8 @@ class PlayerController(DirectObject):
         current_forward = self.signedMag(Vec3(current_speed.x * forwards.x, current_speed.y * forwards.y, 0))
         current_right = self.signedMag(Vec3(current_speed.x * right.x, current_speed.y * right.y, 0))
 
-        contact = False
-
-        check = base.world.contactTest(self.playerRB, BitMask32.bit(0))
-        for collider in check.getContacts():
-            point = collider.getManifoldPoint()
-            if point.getLocalPointA().z < -0.5:
-                contact = True
-
-                if collider.getNode1().getName() != 'Walls' and self.jumpCD < 0:
-                    self.canJump = True
+        contact = self.grounded
+        self.grounded = False
 
         if self.currentState["forward"] and 15 > current_forward:
             speed += self.scale(3.0, forwards)
@@ -338,43 +342,29 @@ class PlayerController(DirectObject):
 
         return task.cont
 
-    def collision_check(self, task):
-        contact = False
-
-        check = base.world.contactTest(self.playerRB)
-        for contact in check.getContacts():
-            point = contact.getManifoldPoint()
-
-            if 'red_crystal' in contact.getNode1().getName():
-                self.redChime.play()
-                if self.r < 1:
-                    self.r += 0.1
-
-                contact.getNode1().removeAllChildren()
-                base.world.remove(contact.getNode1())
-
-            elif 'green_crystal' in contact.getNode1().getName():
-                self.greenChime.play()
-                if self.g < 1:
-                    self.g += 0.1
-
-                contact.getNode1().removeAllChildren()
-                base.world.remove(contact.getNode1())
-
-            elif 'blue_crystal' in contact.getNode1().getName():
-                self.blueChime.play()
-                if self.b < 1:
-                    self.b += 0.1
-
-                contact.getNode1().removeAllChildren()
-                base.world.remove(contact.getNode1())
-
-            elif 'Billboard' in contact.getNode1().getName():
-                self.r -= 0.001 * ((self.score/12) + 1)
-                if self.oofEffect.status() != AudioSound.PLAYING:
-                    self.oofEffect.play()
-
-        return task.cont
+    def touch(self, player, kind, points):
+        """ The player touched something, it's standing on it if any point is below its middle """
+        bottom = self.playerRBNode.getZ() - 0.5
+        if any(point.z < bottom for point in points):
+            self.grounded = True
+
+            if kind != WALL and self.jumpCD < 0:
+                self.canJump = True
+
+    def pick_up(self, player, crystal, points):
+        if crystal.name not in self.crystalMeters:
+            return
+        meter, chime = self.crystalMeters[crystal.name]
+        chime.play()
+        if getattr(self, meter) < 1:
+            setattr(self, meter, getattr(self, meter) + 0.1)
+
+        crystal.removeCrystal()
+
+    def hurt(self, enemy, player, points):
+        self.r -= 0.001 * ((self.score/12) + 1) * len(points)
+        if self.oofEffect.status() != AudioSound.PLAYING:
+            self.oofEffect.play()
 
     def scale(self, s, v):
         return Vec3(s * v.x, s * v.y, s * v.z)
@@ -0,0 +1,86 @@
+import os
+import random
+import unittest
+
+from panda3d.core import Filename
+
+from pathfinder import Pathfinder, NavMap, JPS, FLOW, JPS_PLUS, FREE, WALL, OBSTACLE, readNavMap
+
+SHIPPED_MAP = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'NavMeshes', 'defaultnavmesh.json')
+
+
+def pathLength(path):
+    """ Steps along a path of straight or diagonal segments, every step (diagonals included) costs 1 """
+    return sum(max(abs(x1 - x0), abs(y1 - y0)) for (x0, y0), (x1, y1) in zip(path, path[1:]))
+
+
+def randomMap(seed, size=40, walls=0.25):
+    rng = random.Random(seed)
+    return NavMap([[WALL if rng.random() < walls else FREE for y in range(size)] for x in range(size)])
+
+
+class JumpTableTest(unittest.TestCase):
+    """ JPS+ against the JPS search it replaces and the flow field, which is a breadth first search """
+
+    def compare(self, navmap, seed, count):
+        pathfinders = {}
+        for mode in (JPS, FLOW, JPS_PLUS):
+            pathfinders[mode] = Pathfinder(mode=mode)
+            pathfinders[mode].useMap(navmap)
+
+        rng = random.Random(seed)
+        free = [(x, y) for x in range(navmap.width) for y in range(navmap.height)
+                if navmap.grid[(x + 1) * navmap.stride + y + 1] != OBSTACLE]
+        for _ in range(count):
+            start, goal = rng.choice(free), rng.choice(free)
+            jps = pathfinders[JPS].getPath(start, goal)
+            flow = pathfinders[FLOW].getPath(start, goal)
+            path = pathfinders[JPS_PLUS].getPath(start, goal)
+
+            with self.subTest(start=start, goal=goal):
+                self.assertEqual(path is None, flow is None)
+                if jps is not None:
+                    self.assertIsNotNone(path)
+                if path is None:
+                    continue
+
+                self.assertEqual(path[0], start)
+                self.assertEqual(path[-1], goal)
+                for (x0, y0), (x1, y1) in zip(path, path[1:]):
+                    self.assertTrue(x0 == x1 or y0 == y1 or abs(x1 - x0) == abs(y1 - y0))
+                    steps = max(abs(x1 - x0), abs(y1 - y0))
+                    dx, dy = (x1 - x0) // steps, (y1 - y0) // steps
+                    for step in range(steps + 1):
+                        x, y = x0 + dx * step, y0 + dy * step
+                        self.assertNotEqual(navmap.grid[(x + 1) * navmap.stride + y + 1], OBSTACLE)
+
+                # as short as the breadth first flow field, and never longer than JPS
+                self.assertEqual(pathLength(path), pathLength(flow))
+                if jps is not None:
+                    self.assertLessEqual(pathLength(path), pathLength(jps))
+
+    def testShippedMap(self):
+        navmap = readNavMap(Filename.fromOsSpecific(SHIPPED_MAP).getFullpath())
+        self.assertIsNotNone(navmap)
+        # unnamed, so no tables get saved next to the shipped map
+        self.compare(NavMap.fromGrid(navmap.grid, navmap.width, navmap.height), 1, 200)
+
+    def testRandomMaps(self):
+        for seed in range(5):
+            self.compare(randomMap(seed), seed, 100)
+
+    def testPatchedTableMatchesRebuild(self):
+        navmap = randomMap(7)
+        pathfinder = Pathfinder(mode=JPS_PLUS)
+        pathfinder.useMap(navmap)
+
+        block = [bytes(WALL & 0xff for _ in range(4)) for _ in range(3)]
+        patched, _ = navmap.patched(10, 12, block)
+        rebuilt = Pathfinder(mode=JPS_PLUS)
+        rebuilt.useMap(NavMap.fromGrid(patched.grid, patched.width, patched.height))
+        self.assertEqual(patched.derived[JPS_PLUS].table, rebuilt.jump_table.table)
+        self.compare(patched, 7, 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,253 @@
+import heapq
+import json
+import math
+import zlib
+from array import array
+
+from direct.stdpy.file import exists, open
+
+from pathfinder import OBSTACLE, CLEARANCE, FLOW_DIRECTIONS
+
+# cells whose visible waypoints are remembered before the memo starts over
+MEMO_SIZE = 4096
+
+# maps with more waypoints than this (mazes, not arenas) aren't worth linking, Pathfinder searches them instead
+MAX_WAYPOINTS = 400
+
+
+class VisibilityGraph:
+    """
+    A visibility graph over a NavMap's grid for any-angle paths in open maps.
+
+    Every free cell diagonally next to the convex corner of a wall is a waypoint, since a shortest path only
+    ever bends around such corners, and so is every free cell on either side of a diagonal gap between two walls.
+    Like a step on the grid, a line may pass exactly through the corner two walls meet at. Waypoints that can see each other are linked with their straight line
+    distance, and the shortest routes between every pair of waypoints are precomputed. A query then only has
+    to find the waypoints the start and the goal can see and pick the best pair.
+
+    template marks the blocked cells, e.g. a clearance template so waypoints keep their distance from the walls.
+    """
+
+    def __init__(self, navmap, template=None, clearance=0):
+        self.navmap = navmap
+        self.template = template if template is not None else navmap.template
+        self.clearance = clearance
+
+        self.nodes = []  # flat index of each waypoint
+        self.distance = array('d')  # distance[a * len(nodes) + b], shortest route between waypoints a and b
+        self.next = array('i')  # next[a * len(nodes) + b], the waypoint after a on the way to b, -1 if none
+        self.memo = {}  # flat index -> [(waypoint, distance, cell stepped through or None)] it can see
+
+        # too many waypoints to link, see MAX_WAYPOINTS
+        self.crowded = False
+
+    def checksum(self):
+        """ Identifies the grid and clearance this graph was built for """
+        return zlib.crc32(self.navmap.grid.tobytes()) ^ self.clearance
+
+    def _coordinates(self, index):
+        x, y = divmod(index, self.navmap.stride)
+        return x - 1, y - 1
+
+    def visible(self, a, b):
+        """
+        Is the straight line between the centers of the cells with flat indices a and b clear, ends aside? A line
+        through the exact corner between four cells only needs the cells it runs between, as a diagonal step does.
+        """
+        # the same walk as pathfinder._lineCells, inlined as every query runs it once per waypoint
+        template = self.template
+        stride = self.navmap.stride
+        (ax, ay), (bx, by) = self._coordinates(a), self._coordinates(b)
+        dx = abs(bx - ax)
+        dy = abs(by - ay)
+        step_x = stride if bx > ax else -stride
+        step_y = 1 if by > ay else -1
+        index = a
+        error = dx - dy
+        remaining = dx + dy
+        while remaining > 0:
+            if error > 0:
+                index += step_x
+                error -= 2 * dy
+                remaining -= 1
+            elif error < 0:
+                index += step_y
+                error += 2 * dx
+                remaining -= 1
+            else:
+                index += step_x + step_y
+                error += 2 * (dx - dy)
+                remaining -= 2
+            if index != b and template[index] == OBSTACLE:
+                return False
+        return True
+
+    def _length(self, a, b):
+        (ax, ay), (bx, by) = self._coordinates(a), self._coordinates(b)
+        return math.hypot(bx - ax, by - ay)
+
+    def build(self):
+        pf = self.navmap
+        template = self.template
+        stride = pf.stride
+
+        def blocked(index):
+            return template[index] == OBSTACLE
+
+        def corner(index):
+            """
+            Is index diagonally next to a convex wall corner, free on both sides of it, or a diagonal step away
+            from a free cell between two walls?
+            """
+            for dx in (1, -1):
+                for dy in (1, -1):
+                    sides = blocked(index + dx * stride), blocked(index + dy)
+                    if sides == (False, False) and blocked(index + dx * stride + dy):
+                        return True
+                    if sides == (True, True) and not blocked(index + dx * stride + dy):
+                        return True
+            return False
+
+        self.nodes = [index for x in range(pf.width)
+                      for index in range((x + 1) * stride + 1, (x + 1) * stride + pf.height + 1)
+                      if not blocked(index) and corner(index)]
+        self.crowded = len(self.nodes) > MAX_WAYPOINTS
+        if self.crowded:
+            self.nodes = []
+        count = len(self.nodes)
+
+        edges = [[] for _ in range(count)]
+        for a in range(count):
+            for b in range(a + 1, count):
+                if self.visible(self.nodes[a], self.nodes[b]):
+                    length = self._length(self.nodes[a], self.nodes[b])
+                    edges[a].append((b, length))
+                    edges[b].append((a, length))
+
+        # Dijkstra from every waypoint, remembering the first hop toward everything it reaches
+        self.distance = array('d', [math.inf]) * (count * count)
+        self.next = array('i', [-1]) * (count * count)
+        for source in range(count):
+            row = source * count
+            self.distance[row + source] = 0
+            self.next[row + source] = source
+            queue = [(0, source, source)]
+            while queue:
+                cost, node, first = heapq.heappop(queue)
+                if cost > self.distance[row + node]:
+                    continue
+                for neighbour, length in edges[node]:
+                    new_cost = cost + length
+                    if new_cost < self.distance[row + neighbour]:
+                        self.distance[row + neighbour] = new_cost
+                        self.next[row + neighbour] = neighbour if node == source else first
+                        heapq.heappush(queue, (new_cost, neighbour, neighbour if node == source else first))
+        self.memo = {}
+
+    def patched(self, navmap, region):
+        """
+        The graph for navmap, a copy of this graph's map with the cells in region (x0, x1, y0, y1, the ends
+        excluded) changed. A wall added or removed anywhere can open or close sight lines across the whole map,
+        so the graph is built again, with navmap's clearance template when it keeps a clearance.
+        """
+        template = navmap.derived[(CLEARANCE, self.clearance)] if self.clearance else navmap.template
+        graph = VisibilityGraph(navmap, template, self.clearance)
+        graph.build()
+        return graph
+
+    def save(self, name):
+        data = {
+            'checksum': self.checksum(),
+            'clearance': self.clearance,
+            'crowded': self.crowded,
+            'nodes': self.nodes,
+            'distance': [d if d != math.inf else -1 for d in self.distance],
+            'next': self.next.tolist(),
+        }
+        with open(name, 'w') as outfile:
+            json.dump(data, outfile)
+
+    def load(self, name):
+        """
+        Load a graph saved by save(), only if it was built for the current grid and clearance.
+
+        Return
+        True if the graph was loaded
+        """
+        if not exists(name):
+            return False
+        try:
+            with open(name) as f:
+                data = json.load(f)
+        except:
+            return False
+        if data.get('clearance') != self.clearance or data.get('checksum') != self.checksum():
+            return False
+
+        self.crowded = data.get('crowded', False)
+        self.nodes = data['nodes']
+        self.distance = array('d', [d if d >= 0 else math.inf for d in data['distance']])
+        self.next = array('i', data['next'])
+        self.memo = {}
+        return True
+
+    def _visibleFrom(self, index):
+        """
+        The waypoints the cell with flat index index can see, with their distances. A cell blocked by the template
+        (too close to a wall) looks from the free cells next to it instead, like the flow field lets agents out.
+        """
+        seen = self.memo.get(index)
+        if seen is None:
+            template = self.template
+            if template[index] != OBSTACLE:
+                seen = [(node, self._length(index, self.nodes[node]), None) for node in range(len(self.nodes))
+                        if self.visible(index, self.nodes[node])]
+            else:
+                stride = self.navmap.stride
+                best = {}
+                for dx, dy in FLOW_DIRECTIONS:
+                    step = index + dx * stride + dy
+                    if template[step] == OBSTACLE:
+                        continue
+                    for node, length, _ in self._visibleFrom(step):
+                        length += math.hypot(dx, dy)
+                        if node not in best or length < best[node][1]:
+                            best[node] = node, length, step
+                seen = list(best.values())
+            if len(self.memo) >= MEMO_SIZE:
+                self.memo = {}
+            self.memo[index] = seen
+        return seen
+
+    def getPath(self, start, end):
+        """
+        Find an any-angle path between the free cells with flat indices start and end.
+
+        Return
+        a list of waypoints as 2-tuples (coordinates) starting from the start node and finishing at the end node,
+        every one in sight of the next. None if there is no path.
+        """
+        if start == end or self.visible(start, end):
+            return [self._coordinates(start), self._coordinates(end)]
+
+        count = len(self.nodes)
+        distance = self.distance
+        best = None
+        goals = self._visibleFrom(end)
+        for a, start_length, start_step in self._visibleFrom(start):
+            row = a * count
+            for b, end_length, end_step in goals:
+                length = start_length + distance[row + b] + end_length
+                if best is None or length < best[0]:
+                    best = length, a, b, start_step, end_step
+        if best is None or best[0] == math.inf:
+            return None
+
+        _, a, b, start_step, end_step = best
+        cells = [start, start_step, self.nodes[a]]
+        while a != b:
+            a = self.next[a * count + b]
+            cells.append(self.nodes[a])
+        cells += [end_step, end]
+        cells = [index for index in cells if index is not None]
+        return [self._coordinates(index) for i, index in enumerate(cells) if i == 0 or index != cells[i - 1]]